@@ -0,0 +1,209 @@
+import numpy as np
+
+# ccxt fetch_ohlcv 每一行的顺序
+OHLCV_COLUMNS = ["timestamp", "open", "high", "low", "close", "vol"]
+# csv 沿用的列顺序, 只是表头顺序不同, 取值按列名
+KLINE_COLUMNS = ["timestamp", "open", "close", "low", "high", "vol"]
+TRADE_COLUMNS = ["id", "timestamp", "side", "price", "amount"]
+
+
+def batch_size(batch):
+    if isinstance(batch, Batch):
+        return len(batch)
+    if not batch:
+        return 0
+    return len(next(iter(batch.values())))
+
+
+class Batch:
+    """一批列式数据, 字符串列按字典编码成 int32 code, 按列名取值时才展开.
+
+    和 {列名: ndarray} 的 dict 用法一样(batch["symbol"], len(batch)), 所以 sink
+    和去重不用区分两种格式; 切片, 过滤和拼接只搬 code, 不复制字符串.
+    """
+
+    __slots__ = ("columns", "codes", "dictionaries")
+    fields = ()
+
+    def __init__(self, columns, codes=None, dictionaries=None):
+        self.columns = columns
+        self.codes = codes or {}
+        self.dictionaries = dictionaries or {}
+
+    @classmethod
+    def encode(cls, columns, coded):
+        """把 coded 里的 object 列编码, 其它列原样保留"""
+        codes, dictionaries = {}, {}
+        for name in coded:
+            index = {}
+            values = columns.pop(name)
+            if isinstance(values, np.ndarray):
+                values = values.tolist()
+            codes[name] = np.fromiter(
+                (index.setdefault(value, len(index)) for value in values),
+                dtype=np.int32,
+                count=len(values),
+            )
+            dictionaries[name] = np.array(list(index), dtype=object)
+        return cls(columns, codes, dictionaries)
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def __getitem__(self, name):
+        if name in self.codes:
+            return self.dictionaries[name][self.codes[name]]
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.codes or name in self.columns
+
+    def keys(self):
+        return [name for name in self.fields if name in self]
+
+    def values(self):
+        return [self[name] for name in self.keys()]
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+    @property
+    def nbytes(self):
+        nbytes = sum(code.nbytes for code in self.codes.values())
+        for column in self.columns.values():
+            nbytes += column.nbytes + (
+                56 * len(column) if column.dtype == object else 0
+            )
+        return nbytes
+
+    def take(self, index):
+        """index 可以是布尔掩码, 下标数组或 slice"""
+        return type(self)(
+            {name: column[index] for name, column in self.columns.items()},
+            {name: code[index] for name, code in self.codes.items()},
+            self.dictionaries,
+        )
+
+    def slice(self, start, stop=None):
+        return self.take(slice(start, stop))
+
+    def time_filter(self, unix_start, unix_end):
+        return self.take(time_mask(self, unix_start, unix_end))
+
+    @classmethod
+    def concat(cls, batches):
+        if len(batches) == 1:
+            return batches[0]
+        first = batches[0]
+        columns = {
+            name: np.concatenate([batch.columns[name] for batch in batches])
+            for name in first.columns
+        }
+        codes, dictionaries = {}, {}
+        for name in first.codes:
+            if all(b.dictionaries[name] is first.dictionaries[name] for b in batches):
+                dictionaries[name] = first.dictionaries[name]
+                codes[name] = np.concatenate([batch.codes[name] for batch in batches])
+                continue
+            # 字典不同时合并成一个, 每批的 code 用查表数组一次性映射
+            index, remapped = {}, []
+            for batch in batches:
+                mapping = np.array(
+                    [
+                        index.setdefault(value, len(index))
+                        for value in batch.dictionaries[name].tolist()
+                    ],
+                    dtype=np.int32,
+                )
+                remapped.append(mapping[batch.codes[name]])
+            codes[name] = np.concatenate(remapped)
+            dictionaries[name] = np.array(list(index), dtype=object)
+        return cls(columns, codes, dictionaries)
+
+
+class KlineBatch(Batch):
+    __slots__ = ()
+    fields = ("symbol", *KLINE_COLUMNS)
+
+
+class TradeBatch(Batch):
+    __slots__ = ()
+    fields = ("symbol", *TRADE_COLUMNS)
+
+
+def batch_nbytes(batch):
+    if isinstance(batch, Batch):
+        return batch.nbytes
+    # object 列只算了指针, 按每个 python 字符串约 56 字节估算
+    return sum(
+        column.nbytes + (56 * len(column) if column.dtype == object else 0)
+        for column in (batch or {}).values()
+    )
+
+
+def concat_batches(batches):
+    if isinstance(batches[0], Batch):
+        return type(batches[0]).concat(batches)
+    if len(batches) == 1:
+        return batches[0]
+    return {
+        name: np.concatenate([batch[name] for batch in batches])
+        for name in batches[0].keys()
+    }
+
+
+def filter_batch(batch, mask):
+    if isinstance(batch, Batch):
+        return batch.take(mask)
+    return {name: column[mask] for name, column in batch.items()}
+
+
+def time_mask(batch, unix_start, unix_end):
+    timestamp = batch["timestamp"]
+    return (timestamp >= unix_start) & (timestamp < unix_end)
+
+
+def kline_batch(symbol, result):
+    # ccxt 返回的 [[timestamp, ...], ...] 直接转成列, 不再经过 DataFrame/JSON
+    values = np.asarray(result, dtype=np.float64).reshape(-1, len(OHLCV_COLUMNS))
+    columns = {name: values[:, i] for i, name in enumerate(OHLCV_COLUMNS)}
+    columns["timestamp"] = columns["timestamp"].astype(np.int64)
+    # 一页 K 线只有一个交易对, code 全是 0
+    return KlineBatch(
+        columns,
+        {"symbol": np.zeros(len(values), dtype=np.int32)},
+        {"symbol": np.array([symbol], dtype=object)},
+    )
+
+
+def int_ids(column):
+    """全是不带前导 0 的整数时返回 int64 数组, 否则返回 None"""
+    if column.dtype != object:
+        return column.astype(np.int64)
+    try:
+        ids = column.astype(np.int64)
+    except (ValueError, TypeError, OverflowError):
+        return None
+    # "007" 和 "+7" 能转成整数, 但写回去就变了
+    if not np.array_equal(ids.astype(str), column.astype(str)):
+        return None
+    return ids
+
+
+def trade_batch(trades):
+    ids = np.array([trade["id"].replace("\n", "") for trade in trades], dtype=object)
+    # 整数 id 存 int64, 比 python 字符串省一个数量级的内存; 否则保留字符串
+    int_id = int_ids(ids)
+    return TradeBatch.encode(
+        {
+            "symbol": [trade["symbol"] for trade in trades],
+            "id": ids if int_id is None else int_id,
+            "timestamp": np.array(
+                [trade["timestamp"] for trade in trades], dtype=np.int64
+            ),
+            "side": [trade["side"][0] for trade in trades],
+            "price": np.array([trade["price"] for trade in trades], dtype=np.float64),
+            "amount": np.array([trade["amount"] for trade in trades], dtype=np.float64),
+        },
+        coded=("symbol", "side"),
+    )
@@ -0,0 +1,94 @@
+import hashlib
+import logging
+import os
+import time
+import zlib
+
+import orjson
+
+from funcoin.coins.base.store import SQLiteStore
+
+logger = logging.getLogger("funcoin")
+
+
+def default_cache_path():
+    return os.path.join(os.path.expanduser("~"), ".cache", "funcoin", "response.db")
+
+
+class ResponseCache(SQLiteStore):
+    """已经收盘的 K 线和历史成交不会再变化, 把原始响应压缩后缓存在本地, 超过 max_bytes 按 LRU 淘汰"""
+
+    table_sql = """
+    CREATE TABLE IF NOT EXISTS response_cache (
+        key TEXT PRIMARY KEY,
+        exchange TEXT,
+        endpoint TEXT,
+        size INTEGER NOT NULL,
+        accessed_at REAL NOT NULL,
+        payload BLOB NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS response_cache_accessed ON response_cache (accessed_at);
+    """
+
+    def __init__(self, db_path=None, max_bytes=2 * 1024**3, level=6):
+        super().__init__(db_path=db_path or default_cache_path())
+        self.max_bytes = max_bytes
+        self.level = level
+        self.total_bytes = self.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM response_cache"
+        )[0][0]
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(exchange_id, endpoint, *args, **kwargs):
+        # (exchange, endpoint, symbol, timeframe, since, limit, params) 都在参数里
+        raw = orjson.dumps(
+            [exchange_id, endpoint, args, kwargs], option=orjson.OPT_SORT_KEYS
+        )
+        return hashlib.sha1(raw).hexdigest()
+
+    def get(self, key):
+        rows = self.execute("SELECT payload FROM response_cache WHERE key = ?", (key,))
+        if len(rows) == 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.execute(
+            "UPDATE response_cache SET accessed_at = ? WHERE key = ?",
+            (time.time(), key),
+        )
+        return orjson.loads(zlib.decompress(rows[0][0]))
+
+    def put(self, key, value, exchange_id=None, endpoint=None):
+        payload = zlib.compress(orjson.dumps(value), self.level)
+        with self.lock, self.conn:
+            old = self.conn.execute(
+                "SELECT size FROM response_cache WHERE key = ?", (key,)
+            ).fetchall()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (key, exchange_id, endpoint, len(payload), time.time(), payload),
+            )
+            self.total_bytes += len(payload) - (old[0][0] if old else 0)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        # 从最久没访问的开始删, 直到回到上限的 90%
+        target = self.max_bytes * 0.9
+        with self.lock, self.conn:
+            rows = self.conn.execute(
+                "SELECT key, size FROM response_cache ORDER BY accessed_at"
+            ).fetchall()
+            expired = []
+            for key, size in rows:
+                if self.total_bytes <= target:
+                    break
+                expired.append((key,))
+                self.total_bytes -= size
+            self.conn.executemany("DELETE FROM response_cache WHERE key = ?", expired)
+        logger.info(f"response cache evicted {len(expired)} entries")
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.total_bytes}
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import ccxt
+
+logger = logging.getLogger("funcoin")
+overload_errors = (
+    ccxt.RateLimitExceeded,
+    ccxt.DDoSProtection,
+    ccxt.ExchangeNotAvailable,
+    ccxt.RequestTimeout,
+)
+
+
+def is_overload(error=None, status=None):
+    # 418/429 是被限流或封禁, 5xx 是交易所过载, 都需要降低并发
+    if status is not None and (status in (418, 429) or status >= 500):
+        return True
+    if error is None:
+        return False
+    if isinstance(error, overload_errors):
+        return True
+    return is_overload(status=getattr(error, "status_code", None))
+
+
+class AdaptiveConcurrency:
+    """AIMD 并发控制
+
+    延迟和错误率正常时每个请求把并发上限加 increase / limit,
+    遇到限流、5xx 或延迟超过基线 latency_factor 倍时上限乘以 decrease, 限流时还会整体退避.
+    """
+
+    def __init__(
+        self,
+        initial=4,
+        min_limit=1,
+        max_limit=64,
+        increase=1.0,
+        decrease=0.5,
+        latency_factor=3.0,
+        backoff=1.0,
+        max_backoff=60.0,
+        poll_interval=0.01,
+    ):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.poll_interval = poll_interval
+        self.inflight = 0
+        self.baseline = None
+        self.failures = 0
+        self.backoff_until = 0.0
+        self.cond = threading.Condition()
+
+    def _try_acquire(self):
+        # 拿到名额返回 0, 否则返回建议等待的秒数
+        with self.cond:
+            wait = self.backoff_until - time.time()
+            if wait > 0:
+                return wait
+            if self.inflight >= max(self.min_limit, int(self.limit)):
+                return self.poll_interval
+            self.inflight += 1
+            return 0
+
+    def acquire(self):
+        wait = self._try_acquire()
+        while wait > 0:
+            with self.cond:
+                self.cond.wait(wait)
+            wait = self._try_acquire()
+
+    async def acquire_async(self):
+        wait = self._try_acquire()
+        while wait > 0:
+            await asyncio.sleep(min(wait, self.max_backoff))
+            wait = self._try_acquire()
+
+    def _decrease(self):
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+
+    def release(self, latency=None, error=None, status=None):
+        with self.cond:
+            self.inflight = max(0, self.inflight - 1)
+            if is_overload(error, status):
+                self._decrease()
+                self.failures += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+                self.backoff_until = max(self.backoff_until, time.time() + delay)
+                logger.warning(f"overloaded, concurrency -> {self.limit:.1f}: {error}")
+            elif error is None and latency is not None:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    # 基线缓慢上浮, 避免一次偶然的快请求把阈值压得过低
+                    self.baseline += (latency - self.baseline) * 0.01
+                if latency > self.baseline * self.latency_factor:
+                    self._decrease()
+                else:
+                    self.limit = min(
+                        self.max_limit, self.limit + self.increase / self.limit
+                    )
+                    self.failures = 0
+            self.cond.notify_all()
+
+    def retry_delay(self):
+        # 出错后重试前应等待的秒数
+        with self.cond:
+            delay = self.backoff * 2 ** max(0, self.failures - 1)
+            return max(self.backoff_until - time.time(), min(self.max_backoff, delay))
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        start, error = time.time(), None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # 协程被取消(CancelledError)或 KeyboardInterrupt 时也要归还名额
+            self.release(time.time() - start, error=error)
+
+    @asynccontextmanager
+    async def aslot(self):
+        await self.acquire_async()
+        start, error = time.time(), None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.release(time.time() - start, error=error)
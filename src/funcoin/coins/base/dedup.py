@@ -0,0 +1,50 @@
+from collections import deque
+
+from funcoin.coins.base.batch import filter_batch
+
+
+class TradeDeduper:
+    """最近 window 个 (symbol, id) 精确去重, 内存只和 window 有关, 与一天的成交量无关.
+
+    重复只出现在翻页和分片的接缝处, 相隔很近; 跨天的重叠已经由半开的时间窗口过滤掉.
+    """
+
+    def __init__(self, window=100000):
+        self.window = window
+        self.recent = deque()
+        self.recent_set = set()
+        self.seen = 0
+        self.dropped = 0
+        self.dropped_symbols = {}
+
+    def _add(self, key):
+        self.recent.append(key)
+        self.recent_set.add(key)
+        if len(self.recent) > self.window:
+            self.recent_set.discard(self.recent.popleft())
+
+    def keep_mask(self, symbols, ids):
+        keep = [True] * len(ids)
+        for i, (symbol, trade_id) in enumerate(zip(symbols, ids)):
+            key = f"{symbol}|{trade_id}"
+            if key in self.recent_set:
+                keep[i] = False
+                self.dropped += 1
+                self.dropped_symbols[symbol] = self.dropped_symbols.get(symbol, 0) + 1
+            else:
+                self._add(key)
+        self.seen += len(ids)
+        return keep
+
+    def filter(self, batch):
+        keep = self.keep_mask(batch["symbol"].tolist(), batch["id"].tolist())
+        if all(keep):
+            return batch
+        return filter_batch(batch, keep)
+
+    def stats(self):
+        return {
+            "seen": self.seen,
+            "dropped": self.dropped,
+            "dropped_symbols": dict(self.dropped_symbols),
+        }
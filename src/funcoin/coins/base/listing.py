@@ -0,0 +1,65 @@
+import logging
+
+from ccxt.base.exchange import Exchange
+
+logger = logging.getLogger("funcoin")
+unix_min = 1230768000000  # 2009-01-01
+
+
+def find_listing_time(
+    exchange: Exchange,
+    symbol,
+    unix_end=None,
+    timeframe="1d",
+    unix_floor=unix_min,
+    request=None,
+):
+    """先指数回退、再二分, 找到 symbol 在 unix_end 之前第一根 K 线的时间, 没有数据返回 None
+
+    第一根 K 线的时间同时也是第一笔成交所在的周期, K 线和成交的加载都可以用它跳过空区间.
+    停牌超过回退步长的交易对可能会把停牌前的历史当作不存在.
+    """
+    timeframe_ms = exchange.parse_timeframe(timeframe) * 1000
+    unix_end = (unix_end or exchange.milliseconds()) // timeframe_ms * timeframe_ms
+    unix_floor = unix_floor // timeframe_ms * timeframe_ms
+
+    def first_candle(since):
+        if request is None:
+            result = exchange.fetch_ohlcv(symbol, timeframe, since, limit=1)
+        else:
+            result = request("fetch_ohlcv", symbol, timeframe, since, limit=1)
+        result = [row[0] for row in result if since <= row[0] < unix_end]
+        return min(result) if result else None
+
+    # 指数回退: 找到一个没有 K 线的时间 lo 和一个有 K 线的时间 hi
+    lo, hi, step = None, None, timeframe_ms
+    while lo is None:
+        since = max(unix_end - step, unix_floor)
+        candle = first_candle(since)
+        if candle is not None and candle < since + timeframe_ms:
+            hi = candle
+            if since == unix_floor:
+                return hi
+            step *= 2
+            continue
+        lo = since
+        if candle is not None:
+            # 交易所返回了 since 之后的第一根 K 线, 说明 [since, candle) 之间没有数据
+            hi, lo = candle, candle - timeframe_ms
+        elif hi is None:
+            candle = first_candle(unix_floor)
+            if candle is None:
+                return None
+            hi, lo = candle, max(unix_floor, candle - timeframe_ms)
+
+    # 二分: 保持 lo 没有 K 线、hi 有 K 线, 直到两者相邻
+    while hi - lo > timeframe_ms:
+        mid = lo + (hi - lo) // 2 // timeframe_ms * timeframe_ms
+        candle = first_candle(mid)
+        if candle is not None and candle < mid + timeframe_ms:
+            hi = candle
+        elif candle is not None:
+            hi, lo = candle, candle - timeframe_ms
+        else:
+            lo = mid
+    return hi
@@ -1,31 +1,121 @@
-import csv
-import orjson
+import asyncio
 import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import ccxt
-import pandas as pd
+import ccxt.async_support
 from ccxt.base.exchange import Exchange
 from tqdm import tqdm
 
+from funcoin.coins.base.batch import (
+    KLINE_COLUMNS,
+    OHLCV_COLUMNS,
+    batch_nbytes,
+    batch_size,
+    concat_batches,
+    filter_batch,
+    kline_batch,
+    time_mask,
+    trade_batch,
+)
+from funcoin.coins.base.dedup import TradeDeduper
+from funcoin.coins.base.metrics import atrack_request, registry, track_request
+from funcoin.coins.base.profile import profiler as default_profiler
+from funcoin.coins.base.ratelimit import endpoint_weight
+from funcoin.coins.base.sink import CSVSink, ParquetSink, open_sink
+from funcoin.coins.base.writer import BackgroundWriter
+
 logger = logging.getLogger("funcoin")
 unix_month = 2678400000
 one_hour = 3600 * 1000
+# checkpoint 里记录 sink 已写字节数的伪交易对, 续传时把文件截断到这里
+sink_size_key = "__sink_size__"
+# 支持按成交 id 连续翻页的交易所, 以及 ccxt fetch_trades 里对应的参数
+trade_id_params = {"binance": "fromId", "binanceus": "fromId"}
+
+
+def plan_pages(unix_start, unix_end, timeframe_ms, limit):
+    """把 [unix_start, unix_end) 的 K 线网格切成互不重叠的 (since, limit) 分页"""
+    first = -(-unix_start // timeframe_ms) * timeframe_ms
+    total = max(0, -(-(unix_end - first) // timeframe_ms))
+    return [
+        (first + offset * timeframe_ms, min(limit, total - offset))
+        for offset in range(0, total, limit)
+    ]
 
 
 class BaseLoader:
-    def __init__(self, unix_start, unix_end, *args, **kwargs):
+    def __init__(
+        self,
+        unix_start,
+        unix_end,
+        *args,
+        sink=None,
+        cache_size=None,
+        flush_bytes=8 << 20,
+        flush_interval=10.0,
+        max_buffer_bytes=256 << 20,
+        background_write=True,
+        checkpoint=None,
+        checkpoint_key=None,
+        profiler=None,
+        **kwargs,
+    ):
         self.unix_start = unix_start
+        self.profiler = profiler or default_profiler
         self.unix_end = unix_end
+        self.sink = sink
+        # 攒够 flush_bytes 字节或者距第一条超过 flush_interval 秒, 交给后台线程写;
+        # 已交出未写完的数据超过 max_buffer_bytes 时 write_data 阻塞
+        self.cache_size = cache_size
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.max_buffer_bytes = max_buffer_bytes
+        self.background_write = background_write
+        self.writer = None
         self.cache_data = []
+        self.cache_rows = 0
+        self.cache_bytes = 0
+        self.cache_since = None
+        self.checkpoint = checkpoint
+        self.checkpoint_key = checkpoint_key
+        self.cursors = {}
+        self.pending_cursors = {}
+        if self.checkpoint is not None:
+            self.cursors = self.checkpoint.load(self.checkpoint_key)
+
+    def update_cursor(self, symbol, cursor=None, last_id=None, done=False):
+        # 在对应数据的 write_data 之前调用, 数据真正写入 sink 后才落到 checkpoint
+        if self.checkpoint is not None:
+            self.pending_cursors[symbol] = (cursor, last_id, done)
+
+    def _commit_cursors(self, cursors):
+        if self.checkpoint is not None and len(cursors) > 0:
+            self.checkpoint.save(self.checkpoint_key, cursors)
+            self.cursors.update(cursors)
 
     def _open(self, *args, **kwargs):
         pass
 
-    def _write(self, data_list):
-        pass
+    def _write(self, batch):
+        if self.sink is not None:
+            with self.profiler.stage("write", rows=batch_size(batch)) as span:
+                size = self.sink.size()
+                self.sink.write(batch)
+                span["bytes"] = self.sink.size() - size
 
     def _close(self, *args, **kwargs):
-        pass
+        try:
+            if self.writer is not None:
+                writer, self.writer = self.writer, None
+                writer.close()
+        finally:
+            if self.sink is not None:
+                self.sink.close()
 
     def _load_symbols(self, *args, **kwargs):
         pass
@@ -35,26 +125,63 @@ class BaseLoader:
 
     def load_symbols(self, *args, **kwargs):
         self._open(*args, **kwargs)
-        self._load_symbols(*args, **kwargs)
-        self._close(*args, **kwargs)
+        try:
+            self._load_symbols(*args, **kwargs)
+        finally:
+            # 出错时也要等后台线程写完已交出的数据并关闭 sink, 否则它会在失败之后继续写文件
+            self._close(*args, **kwargs)
 
     def load_symbol(self, symbol, pbr=None, *args, **kwargs):
         self._open(*args, **kwargs)
-        self._load_symbol(symbol=symbol, pbr=pbr, *args, **kwargs)
-        self._close(*args, **kwargs)
+        try:
+            self._load_symbol(symbol=symbol, pbr=pbr, *args, **kwargs)
+        finally:
+            self._close(*args, **kwargs)
 
-    def write_data(self, data_list, cache=True):
-        self.cache_data.extend(data_list)
-        if cache and len(self.cache_data) < 10000:
-            return
-        if len(self.cache_data) == 0:
+    def _cache_full(self):
+        if self.cache_size is not None and self.cache_rows >= self.cache_size:
+            return True
+        if self.cache_bytes >= self.flush_bytes:
+            return True
+        return (
+            self.cache_since is not None
+            and time.monotonic() - self.cache_since >= self.flush_interval
+        )
+
+    def write_data(self, batch, cache=True):
+        size = batch_size(batch)
+        if size > 0:
+            self.cache_data.append(batch)
+            self.cache_rows += size
+            self.cache_bytes += batch_nbytes(batch)
+            if self.cache_since is None:
+                self.cache_since = time.monotonic()
+        if cache and not self._cache_full():
             return
-        df = pd.DataFrame(self.cache_data)
-        df = df[
-            (df["timestamp"] >= self.unix_start) & (df["timestamp"] <= self.unix_end)
-        ]
-        self._write(orjson.loads(df.to_json(orient="records")))
-        self.cache_data.clear()
+        # cursor 跟着它对应的数据一起交出去, 数据写进 sink 之后才提交
+        item = (self.cache_data, self.pending_cursors)
+        with self.profiler.stage("write_data", rows=self.cache_rows):
+            if not self.background_write:
+                self._flush(item)
+            else:
+                if self.writer is None:
+                    self.writer = BackgroundWriter(self._flush, self.max_buffer_bytes)
+                waited = self.writer.submit(item, self.cache_bytes)
+                if waited > 0.001:
+                    self.profiler.record("backpressure", wall=waited)
+        self.cache_data, self.pending_cursors = [], {}
+        self.cache_rows, self.cache_bytes, self.cache_since = 0, 0, None
+
+    def _flush(self, item):
+        batches, cursors = item
+        if len(batches) > 0:
+            batch = concat_batches(batches)
+            self._write(
+                filter_batch(batch, time_mask(batch, self.unix_start, self.unix_end))
+            )
+        if self.sink is not None and self.sink.appendable and len(cursors) > 0:
+            cursors = {**cursors, sink_size_key: (self.sink.size(), None, False)}
+        self._commit_cursors(cursors)
 
     def __enter__(self):
         self._handle = self
@@ -63,7 +190,7 @@ class BaseLoader:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.cache_data is not None:
-            self.write_data([], cache=False)
+            self.write_data(None, cache=False)
         self._close()
         return True
 
@@ -71,110 +198,531 @@ class BaseLoader:
 class CSVLoader(BaseLoader):
     def __init__(self, csv_path, fieldnames, *args, **kwargs):
         self.csv_path = csv_path
-        super().__init__(*args, **kwargs)
-        self.csv_file = open(self.csv_path, mode="w")
-        self.csv_writer = csv.DictWriter(
-            self.csv_file, delimiter=",", fieldnames=fieldnames
-        )
-        self.csv_writer.writeheader()
+        super().__init__(*args, sink=CSVSink(csv_path, fieldnames), **kwargs)
 
-    def _write(self, data_list):
-        self.csv_writer.writerows(data_list)
-        self.csv_file.flush()
 
-    def _close(self, *args, **kwargs):
-        self.csv_file.close()
+class ParquetLoader(BaseLoader):
+    def __init__(
+        self, parquet_path, fieldnames, *args, row_group_size=1000000, **kwargs
+    ):
+        self.parquet_path = parquet_path
+        super().__init__(
+            *args,
+            sink=ParquetSink(parquet_path, fieldnames, row_group_size=row_group_size),
+            **kwargs,
+        )
+
 
+class CCXTBaseLoader(BaseLoader):
+    # 实现了 _aload_symbol 的子类设为 True
+    supports_async = False
 
-class CCXTBaseLoader(CSVLoader):
-    def __init__(self, exchange: Exchange, *args, **kwargs):
+    def __init__(
+        self,
+        exchange: Exchange,
+        *args,
+        fieldnames=None,
+        csv_path=None,
+        parquet_path=None,
+        tsc_path=None,
+        codec=None,
+        schema=None,
+        use_async=False,
+        max_concurrency=8,
+        checkpoint=None,
+        checkpoint_key=None,
+        market_index=None,
+        rate_limiter=None,
+        controller=None,
+        metrics=None,
+        response_cache=None,
+        async_exchange=None,
+        **kwargs,
+    ):
+        if use_async and not self.supports_async:
+            # 在打开 sink 之前就拒绝, 不要等到 gather 里才失败
+            raise ValueError(f"{type(self).__name__} does not support use_async")
         self.exchange = exchange
-        super().__init__(*args, **kwargs)
+        # 外部传入的异步 exchange(比如压测用的假交易所), 由调用方负责关闭
+        self.async_exchange = async_exchange
+        self.use_async = use_async
+        self.max_concurrency = max_concurrency
+        self.market_index = market_index
+        self.rate_limiter = rate_limiter
+        self.controller = controller
+        self.metrics = metrics or registry
+        self.response_cache = response_cache
+        # 重试用尽也没下载完的交易对, 调用方据此判断这一天的数据是否完整
+        self.incomplete = set()
+        path = parquet_path or tsc_path or csv_path
+        resume = False
+        if checkpoint is not None:
+            checkpoint_key = checkpoint_key or os.path.abspath(path)
+            # 只有可追加的 sink 并且上次的文件还在, 才能接着 checkpoint 继续
+            resume = (
+                parquet_path is None
+                and tsc_path is None
+                and codec is None
+                and os.path.exists(path)
+                and len(checkpoint.load(checkpoint_key)) > 0
+            )
+            if not resume:
+                checkpoint.clear(checkpoint_key)
+            else:
+                # 上次可能在写到一半时退出, 丢掉 checkpoint 之后写入的部分
+                size = checkpoint.load(checkpoint_key).get(sink_size_key)
+                if size is not None and size[0] < os.path.getsize(path):
+                    os.truncate(path, size[0])
+        if kwargs.get("sink") is None:
+            kwargs["sink"] = open_sink(
+                fieldnames,
+                csv_path=csv_path,
+                parquet_path=parquet_path,
+                tsc_path=tsc_path,
+                append=resume,
+                codec=codec,
+                schema=schema,
+            )
+        super().__init__(
+            *args, checkpoint=checkpoint, checkpoint_key=checkpoint_key, **kwargs
+        )
         self.exchange.load_markets()
 
+    def _spot_symbols(self):
+        skip = set()
+        if self.market_index is not None:
+            skip = self.market_index.skip_symbols(self.unix_start, self.unix_end)
+        return [
+            sym
+            for sym in self.exchange.symbols
+            if ":" not in sym
+            and sym not in skip
+            and not self.cursors.get(sym, (None, None, False))[2]
+        ]
+
+    def _request(self, method, *args, cache=False, **kwargs):
+        # cache=True 表示调用方确认请求的时间窗口已经结束, 响应不会再变化
+        if cache and self.response_cache is not None:
+            key = self.response_cache.make_key(
+                self.exchange.id, method, *args, **kwargs
+            )
+            result = self.response_cache.get(key)
+            if result is None:
+                result = self._send(method, *args, **kwargs)
+                self.response_cache.put(key, result, self.exchange.id, method)
+            return result
+        return self._send(method, *args, **kwargs)
+
+    def _send(self, method, *args, **kwargs):
+        # 所有 REST 请求都从这里发出, 先从共享的令牌桶里按接口权重取令牌
+        with self._track(self.exchange, method, args):
+            return getattr(self.exchange, method)(*args, **kwargs)
+
+    async def _arequest(self, exchange, method, *args, cache=False, **kwargs):
+        if cache and self.response_cache is not None:
+            key = self.response_cache.make_key(exchange.id, method, *args, **kwargs)
+            result = self.response_cache.get(key)
+            if result is None:
+                result = await self._asend(exchange, method, *args, **kwargs)
+                self.response_cache.put(key, result, exchange.id, method)
+            return result
+        return await self._asend(exchange, method, *args, **kwargs)
+
+    async def _asend(self, exchange, method, *args, **kwargs):
+        async with self._track(exchange, method, args, track=atrack_request):
+            return await getattr(exchange, method)(*args, **kwargs)
+
+    def _track(self, exchange, method, args, track=track_request):
+        return track(
+            exchange.id,
+            method,
+            endpoint_weight(exchange.id, method),
+            rate_limiter=self.rate_limiter,
+            controller=self.controller,
+            # 并发时 last_response_headers 可能来自别的请求, 但已用权重是账号级的, 不影响
+            headers=lambda: getattr(exchange, "last_response_headers", None),
+            metrics=self.metrics,
+            profiler=self.profiler,
+            # fetch_ohlcv/fetch_trades 的第一个参数是交易对
+            symbol=args[0] if args else None,
+        )
+
+    def _retry_delay(self):
+        if self.controller is None:
+            return 1000
+        return int(self.controller.retry_delay() * 1000)
+
+    def _symbol_start(self, symbol):
+        # 上线之前的区间没有数据, 直接跳过
+        unix_start = self.unix_start
+        if self.market_index is not None:
+            listed_at = self.market_index.listing_time(symbol)
+            if listed_at is not None:
+                unix_start = max(unix_start, listed_at)
+        return unix_start
+
+    def _async_exchange(self):
+        if self.async_exchange is not None:
+            return self.async_exchange
+        # 复用同步 exchange 的账号与市场信息, 由 ccxt 的异步限流器控制请求频率
+        exchange = getattr(ccxt.async_support, self.exchange.id)(
+            {
+                "apiKey": self.exchange.apiKey,
+                "secret": self.exchange.secret,
+                "enableRateLimit": True,
+            }
+        )
+        exchange.set_markets(self.exchange.markets, self.exchange.currencies)
+        return exchange
+
     def _load_symbols(self, *args, **kwargs):
-        pbr = tqdm(self.exchange.symbols)
-        for sym in pbr:
-            if ":" not in sym:
+        if self.use_async:
+            asyncio.run(self._aload_symbols(*args, **kwargs))
+        else:
+            pbr = tqdm(self._spot_symbols())
+            for sym in pbr:
                 pbr.set_description(sym)
-                self._load_symbol(sym, pbr, *args, **kwargs)
-        self.write_data([], False)
+                with self.profiler.stage("load_symbol", sym):
+                    self._load_symbol(sym, pbr, *args, **kwargs)
+        self.write_data(None, False)
+
+    async def _aload_symbols(self, *args, **kwargs):
+        symbols = self._spot_symbols()
+        exchange = self._async_exchange()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        pbr = tqdm(total=len(symbols))
+
+        async def load(sym):
+            async with semaphore:
+                with self.profiler.stage("load_symbol", sym, cpu=False):
+                    await self._aload_symbol(exchange, sym, pbr, *args, **kwargs)
+                pbr.set_description(sym)
+                pbr.update(1)
+
+        try:
+            await asyncio.gather(*[load(sym) for sym in symbols])
+        finally:
+            pbr.close()
+            if exchange is not self.async_exchange:
+                await exchange.close()
+
+    async def _aload_symbol(self, exchange, symbol, pbr=None, *args, **kwargs):
+        raise NotImplementedError(f"{type(self).__name__} does not support async mode")
 
 
 class KlineLoder(CCXTBaseLoader):
-    def __init__(self, *args, timeframe="1m", **kwargs):
+    supports_async = True
+
+    def __init__(
+        self,
+        *args,
+        timeframe="1m",
+        limit=None,
+        page_concurrency=4,
+        max_retries=10,
+        **kwargs,
+    ):
+        # csv 保持原来的表头顺序, parquet/tsc 按 ccxt 的 OHLCV 顺序存
+        columns = (
+            KLINE_COLUMNS
+            if kwargs.get("parquet_path") is None and kwargs.get("tsc_path") is None
+            else OHLCV_COLUMNS
+        )
         super(KlineLoder, self).__init__(
-            fieldnames=["symbol", "timestamp", "open", "close", "low", "high", "vol"],
+            fieldnames=["symbol", *columns],
             *args,
             **kwargs,
         )
         self.timeframe = timeframe
+        self.limit = limit
+        self.page_concurrency = page_concurrency
+        self.max_retries = max_retries
 
-    def _load_symbol(self, symbol, pbr=None, *args, **kwargs):
-        unix_temp = self.unix_start
-        for _ in range(1000):
-            if unix_temp >= self.unix_end:
-                break
+    def _page_limit(self):
+        if self.limit:
+            return self.limit
+        features = getattr(self.exchange, "features", None) or {}
+        return ((features.get("spot") or {}).get("fetchOHLCV") or {}).get(
+            "limit"
+        ) or 500
+
+    def _plan_pages(self, symbol):
+        timeframe_ms = self.exchange.parse_timeframe(self.timeframe) * 1000
+        unix_start = self._symbol_start(symbol)
+        cursor = self.cursors.get(symbol, (None, None, False))[0]
+        if cursor is not None:
+            unix_start = max(unix_start, cursor + timeframe_ms)
+        pages = plan_pages(unix_start, self.unix_end, timeframe_ms, self._page_limit())
+        return [(since, limit, since + limit * timeframe_ms) for since, limit in pages]
+
+    def _write_pages(self, symbol, results):
+        cursor = self.cursors.get(symbol, (None, None, False))[0]
+        for result in results:
+            if result is None:
+                # 有分页失败, cursor 停在失败页之前, 下次从这里续传
+                self.incomplete.add(symbol)
+                return
+            if len(result) > 0:
+                result = self.exchange.sort_by(result, 0)
+                cursor = result[-1][0]
+                self.update_cursor(symbol, cursor)
+                with self.profiler.stage("batch", symbol, rows=len(result)):
+                    batch = kline_batch(symbol, result)
+                self.write_data(batch)
+        self.update_cursor(symbol, cursor, done=True)
+
+    def _fetch_page(self, symbol, since, limit, until):
+        for _ in range(self.max_retries):
             try:
-                result = self.exchange.fetch_ohlcv(
-                    symbol, self.timeframe, unix_temp, limit=500
+                result = self._request(
+                    "fetch_ohlcv",
+                    symbol,
+                    self.timeframe,
+                    since,
+                    limit=limit,
+                    cache=until <= self.exchange.milliseconds(),
                 )
-                result = self.exchange.sort_by(result, 0)
-                if len(result) == 0:
-                    break
-                unix_temp = result[-1][0]
-                df = pd.DataFrame(
-                    result, columns=["timestamp", "open", "close", "low", "high", "vol"]
+                return [row for row in result if since <= row[0] < until]
+            except Exception as e:
+                logger.error(e)
+                self.exchange.sleep(self._retry_delay())
+        logger.error(f"{symbol} page {since} failed after {self.max_retries} retries")
+        return None
+
+    def _load_symbol(self, symbol, pbr=None, *args, **kwargs):
+        pages = self._plan_pages(symbol)
+        with ThreadPoolExecutor(max_workers=self.page_concurrency) as executor:
+            results = executor.map(lambda page: self._fetch_page(symbol, *page), pages)
+            self._write_pages(symbol, results)
+
+    async def _afetch_page(self, exchange, symbol, since, limit, until):
+        for _ in range(self.max_retries):
+            try:
+                result = await self._arequest(
+                    exchange,
+                    "fetch_ohlcv",
+                    symbol,
+                    self.timeframe,
+                    since,
+                    limit=limit,
+                    cache=until <= exchange.milliseconds(),
                 )
-                df["symbol"] = symbol
-                self.write_data(orjson.loads(df.to_json(orient="records")))
-                # time.sleep(int(self.exchange.rateLimit / 1000))
+                return [row for row in result if since <= row[0] < until]
             except Exception as e:
                 logger.error(e)
-                self.exchange.sleep(1000)
+                await exchange.sleep(self._retry_delay())
+        logger.error(f"{symbol} page {since} failed after {self.max_retries} retries")
+        return None
+
+    async def _aload_symbol(self, exchange, symbol, pbr=None, *args, **kwargs):
+        semaphore = asyncio.Semaphore(self.page_concurrency)
+
+        async def fetch(page):
+            async with semaphore:
+                return await self._afetch_page(exchange, symbol, *page)
+
+        results = await asyncio.gather(
+            *[fetch(page) for page in self._plan_pages(symbol)]
+        )
+        self._write_pages(symbol, results)
 
 
 class TradeLoader(CCXTBaseLoader):
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        pagination="auto",
+        max_retries=10,
+        dedup_window=100000,
+        deduper=None,
+        shards=1,
+        shard_min_volume=0,
+        shard_buffer=8,
+        **kwargs,
+    ):
         super(TradeLoader, self).__init__(
             fieldnames=["symbol", "id", "timestamp", "side", "price", "amount"],
             *args,
             **kwargs,
         )
+        self.pagination = pagination
+        self.max_retries = max_retries
+        self.deduper = deduper or TradeDeduper(window=dedup_window)
+        self.shards = shards
+        self.shard_min_volume = shard_min_volume
+        # 每个分片最多预取的页数, 后面的分片等前面的写完再继续
+        self.shard_buffer = shard_buffer
 
-    def _load_symbol(self, symbol, pbr=None, *args, **kwargs):
-        unix_temp = self.unix_start
-        previous_trade_id = None
+    def _load_symbols(self, *args, **kwargs):
+        super()._load_symbols(*args, **kwargs)
+        stats = self.deduper.stats()
+        logger.info(f"trade dedup: seen={stats['seen']}, dropped={stats['dropped']}")
+
+    def _trade_batch(self, symbol, trades):
+        with self.profiler.stage("batch", symbol, rows=len(trades)):
+            return trade_batch(trades)
+
+    def _id_param(self):
+        if self.pagination == "time":
+            return None
+        param = trade_id_params.get(self.exchange.id)
+        if param is None and self.pagination == "id":
+            raise ValueError(f"{self.exchange.id} does not support trade id pagination")
+        return param
+
+    def _use_shards(self, symbol):
+        if self.shards <= 1:
+            return False
+        if self.market_index is None:
+            return True
+        return self.market_index.volume(symbol) >= self.shard_min_volume
+
+    def _fetch_trades(self, symbol, since, errors, params=None):
+        # 按时间请求最多覆盖 since 之后一小时, 按 id 请求只在整个窗口结束一小时后才缓存
+        closed = (self.unix_end if since is None else since) + one_hour
+        try:
+            return self._request(
+                "fetch_trades",
+                symbol,
+                since,
+                limit=1000,
+                params=params or {},
+                cache=closed <= self.exchange.milliseconds(),
+            )
+        except ccxt.NetworkError as e:
+            logger.error(e)
+            if errors + 1 >= self.max_retries:
+                raise
+            self.exchange.sleep(self._retry_delay())
+            return None
+
+    def _iter_trades_by_time(self, symbol, unix_start, unix_end, last_id=None):
+        unix_temp, errors = unix_start, 0
         for _ in range(10000):
-            pbr.set_description(f"{symbol}-{unix_temp}")
-            if unix_temp >= self.unix_end:
-                break
-            try:
-                trades = self.exchange.fetch_trades(symbol, unix_temp, limit=1000)
+            if unix_temp >= unix_end:
+                return
+            trades = self._fetch_trades(symbol, unix_temp, errors)
+            if trades is None:
+                errors += 1
+                continue
+            errors = 0
+            if len(trades) == 0:
+                unix_temp += one_hour
+                continue
+            last_trade = trades[-1]
+            if last_id == last_trade["id"]:
+                unix_temp += one_hour
+                continue
+            # 下一页从上一页最后一笔的时间开始, 跳过已经返回过的成交
+            trade_ids = [trade["id"] for trade in trades]
+            if last_id in trade_ids:
+                trades = trades[trade_ids.index(last_id) + 1 :]
+            unix_temp = last_trade["timestamp"]
+            last_id = last_trade["id"]
+            yield self._trade_batch(symbol, trades)
+        raise RuntimeError(f"{symbol} trades stopped at {unix_temp}")
+
+    def _iter_trades_by_id(self, symbol, unix_start, unix_end, last_id=None):
+        # 先按时间找到窗口内的第一笔成交, 之后按 id 连续翻页, 没有重叠也不需要跳跃
+        param = self._id_param()
+        unix_temp, errors = unix_start, 0
+        while unix_temp < unix_end:
+            if last_id is None:
+                trades = self._fetch_trades(symbol, unix_temp, errors)
+            else:
+                params = {param: int(last_id) + 1}
+                trades = self._fetch_trades(symbol, None, errors, params=params)
+            if trades is None:
+                errors += 1
+                continue
+            errors = 0
+            if last_id is None and len(trades) == 0:
+                unix_temp += one_hour
+                continue
+            if last_id is not None:
+                trades = [t for t in trades if int(t["id"]) > int(last_id)]
                 if len(trades) == 0:
-                    unix_temp += one_hour
+                    return
+            unix_temp = trades[-1]["timestamp"]
+            last_id = trades[-1]["id"]
+            yield self._trade_batch(symbol, trades)
+
+    def _iter_trades(self, symbol, unix_start, unix_end, last_id=None):
+        if self._id_param() is not None:
+            return self._iter_trades_by_id(symbol, unix_start, unix_end, last_id)
+        return self._iter_trades_by_time(symbol, unix_start, unix_end, last_id)
+
+    def _iter_trades_sharded(self, symbol, unix_start, last_id=None):
+        # 把窗口切成 shards 段并发下载, 按顺序拼接; 每段裁剪到自己的时间范围, 接缝处再由 id 去重
+        step = -(-(self.unix_end - unix_start) // self.shards)
+        bounds = [
+            (start, min(start + step, self.unix_end))
+            for start in range(unix_start, self.unix_end, step)
+        ]
+
+        # 每个分片一个有界队列, 按分片顺序消费; 队列满了分片线程就停下, 内存有上限
+        queues = [queue.Queue(maxsize=self.shard_buffer) for _ in bounds]
+        stop, finished = threading.Event(), object()
+
+        def put(index, item):
+            while not stop.is_set():
+                try:
+                    queues[index].put(item, timeout=0.1)
+                    return True
+                except queue.Full:
                     continue
-                last_trade = trades[-1]
-                if previous_trade_id == last_trade["id"]:
-                    unix_temp += one_hour
+            return False
+
+        def fetch(index):
+            start, end = bounds[index]
+            try:
+                for batch in self._iter_trades(
+                    symbol, start, end, last_id if index == 0 else None
+                ):
+                    if not put(
+                        index, filter_batch(batch, time_mask(batch, start, end))
+                    ):
+                        return
+            except Exception as e:
+                put(index, e)
+                return
+            put(index, finished)
+
+        with ThreadPoolExecutor(max_workers=len(bounds)) as executor:
+            for index in range(len(bounds)):
+                executor.submit(fetch, index)
+            try:
+                for shard in queues:
+                    item = shard.get()
+                    while item is not finished:
+                        if isinstance(item, Exception):
+                            raise item
+                        yield item
+                        item = shard.get()
+            finally:
+                # 消费方出错或提前退出时让分片线程尽快结束
+                stop.set()
+
+    def _load_symbol(self, symbol, pbr=None, *args, **kwargs):
+        cursor, last_id, _ = self.cursors.get(symbol, (None, None, False))
+        unix_start = self._symbol_start(symbol) if cursor is None else cursor
+        if self._use_shards(symbol) and unix_start < self.unix_end:
+            batches = self._iter_trades_sharded(symbol, unix_start, last_id)
+        else:
+            batches = self._iter_trades(symbol, unix_start, self.unix_end, last_id)
+        try:
+            for batch in batches:
+                if batch_size(batch) == 0:
                     continue
-                unix_temp = last_trade["timestamp"]
-                previous_trade_id = last_trade["id"]
-
-                result = [
-                    {
-                        "symbol": trade["symbol"],
-                        "id": trade["id"].replace("\n", ""),
-                        "timestamp": int(trade["timestamp"]),
-                        "side": trade["side"][0],
-                        "price": trade["price"],
-                        "amount": trade["amount"],
-                    }
-                    for trade in trades
-                ]
-
-                self.write_data(result)
-                # time.sleep(int(self.exchange.rateLimit / 1000))
-            except ccxt.NetworkError as e:
-                logger.error(e)
-                self.exchange.sleep(1000)
+                # id 列可能是 int64, cursor 里统一存字符串, 和 ccxt 返回的 id 比较
+                cursor, last_id = int(batch["timestamp"][-1]), str(batch["id"][-1])
+                if pbr is not None:
+                    pbr.set_description(f"{symbol}-{cursor}")
+                self.update_cursor(symbol, cursor, last_id)
+                self.write_data(self.deduper.filter(batch))
+        except Exception as e:
+            # 不标记完成, 下次从 cursor 续传
+            logger.error(f"{symbol} trades stopped at {cursor}: {e}")
+            self.incomplete.add(symbol)
+            return
+        self.update_cursor(symbol, cursor, last_id, done=True)
@@ -0,0 +1,175 @@
+import logging
+import time
+
+from ccxt.base.exchange import Exchange
+
+from funcoin.coins.base.listing import find_listing_time
+from funcoin.coins.base.metrics import registry, track_request
+from funcoin.coins.base.ratelimit import endpoint_weight
+from funcoin.coins.base.store import SQLiteStore
+
+logger = logging.getLogger("funcoin")
+one_day = 24 * 3600 * 1000
+
+
+class MarketIndex(SQLiteStore):
+    table_sql = """
+    CREATE TABLE IF NOT EXISTS market_index (
+        exchange TEXT NOT NULL,
+        symbol TEXT NOT NULL,
+        active INTEGER NOT NULL DEFAULT 1,
+        listed_at INTEGER,
+        last_trade_at INTEGER,
+        volume REAL,
+        updated_at REAL,
+        PRIMARY KEY (exchange, symbol)
+    );
+    """
+
+    def __init__(
+        self, exchange: Exchange, db_path=None, rate_limiter=None, metrics=None
+    ):
+        super().__init__(db_path=db_path)
+        self.exchange = exchange
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics or registry
+
+    def _request(self, method, *args, **kwargs):
+        with track_request(
+            self.exchange.id,
+            method,
+            endpoint_weight(self.exchange.id, method),
+            rate_limiter=self.rate_limiter,
+            headers=lambda: getattr(self.exchange, "last_response_headers", None),
+            metrics=self.metrics,
+        ):
+            return getattr(self.exchange, method)(*args, **kwargs)
+
+    def rows(self):
+        rows = self.execute(
+            "SELECT symbol, active, listed_at, last_trade_at, volume FROM market_index"
+            " WHERE exchange = ?",
+            (self.exchange.id,),
+        )
+        return {
+            symbol: {
+                "active": bool(active),
+                "listed_at": listed_at,
+                "last_trade_at": last_trade_at,
+                "volume": volume,
+            }
+            for symbol, active, listed_at, last_trade_at, volume in rows
+        }
+
+    def _fetch_tickers(self):
+        try:
+            return self._request("fetch_tickers")
+        except Exception as e:
+            logger.error(f"fetch tickers failed: {e}")
+            return {}
+
+    def _last_candle_end(self, symbol):
+        # 不带 since 时交易所返回最近的 K 线, 用它的结束时间作为最后成交时间的上界
+        try:
+            result = self._request("fetch_ohlcv", symbol, "1d", limit=1)
+        except Exception as e:
+            logger.error(f"{symbol} fetch last candle failed: {e}")
+            return None
+        if len(result) == 0:
+            return None
+        return result[-1][0] + one_day
+
+    def refresh(self):
+        self.exchange.load_markets()
+        now = self.exchange.milliseconds()
+        tickers = self._fetch_tickers()
+        rows = self.rows()
+        updates = []
+        for symbol, market in self.exchange.markets.items():
+            if ":" in symbol:
+                continue
+            row = rows.get(symbol, {})
+            active = market.get("active") is not False
+            listed_at = row.get("listed_at") or market.get("created")
+            volume = (tickers.get(symbol) or {}).get("quoteVolume") or 0
+            if volume > 0:
+                last_trade_at = now
+            elif (
+                len(row) == 0
+                or row["active"] != active
+                or row["last_trade_at"] is None
+                or (row["volume"] or 0) > 0
+            ):
+                # 只有新增、状态变化或刚变成零成交量的交易对才需要探测一次
+                last_trade_at = self._last_candle_end(symbol)
+            else:
+                last_trade_at = row["last_trade_at"]
+            updates.append(
+                (
+                    self.exchange.id,
+                    symbol,
+                    int(active),
+                    listed_at,
+                    last_trade_at,
+                    volume,
+                    time.time(),
+                )
+            )
+        self.executemany(
+            "INSERT OR REPLACE INTO market_index VALUES (?, ?, ?, ?, ?, ?, ?)", updates
+        )
+        logger.info(f"market index refreshed, {len(updates)} symbols")
+        return self
+
+    def update_listing(self, symbol, listed_at):
+        self.execute(
+            "UPDATE market_index SET listed_at = ? WHERE exchange = ? AND symbol = ?",
+            (listed_at, self.exchange.id, symbol),
+        )
+
+    def discover_listings(self, symbols=None):
+        # 每个交易对只搜索一次, 结果缓存在 listed_at 里; 没有数据时记为搜索时刻, 表示在此之前没有数据
+        now = self.exchange.milliseconds()
+        rows = self.rows()
+        for symbol in symbols or list(rows.keys()):
+            if (rows.get(symbol) or {}).get("listed_at") is not None:
+                continue
+            try:
+                listed_at = find_listing_time(
+                    self.exchange, symbol, unix_end=now, request=self._request
+                )
+            except Exception as e:
+                logger.error(f"{symbol} listing time discovery failed: {e}")
+                continue
+            self.update_listing(symbol, now if listed_at is None else listed_at)
+        return self
+
+    def listing_time(self, symbol):
+        return self._value("listed_at", symbol)
+
+    def earliest_listing(self):
+        # 只有所有交易对都知道上线时间时才有意义
+        listed = [row["listed_at"] for row in self.rows().values()]
+        if len(listed) == 0 or None in listed:
+            return None
+        return min(listed)
+
+    def _value(self, column, symbol):
+        rows = self.execute(
+            f"SELECT {column} FROM market_index WHERE exchange = ? AND symbol = ?",
+            (self.exchange.id, symbol),
+        )
+        return rows[0][0] if rows else None
+
+    def volume(self, symbol):
+        return self._value("volume", symbol) or 0
+
+    def skip_symbols(self, unix_start, unix_end):
+        """[unix_start, unix_end) 内确定没有数据的交易对, 不在索引里的交易对不会被跳过"""
+        skip = set()
+        for symbol, row in self.rows().items():
+            if row["listed_at"] is not None and row["listed_at"] >= unix_end:
+                skip.add(symbol)
+            elif row["last_trade_at"] is not None and row["last_trade_at"] < unix_start:
+                skip.add(symbol)
+        return skip
@@ -0,0 +1,252 @@
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import orjson
+
+from funcoin.coins.base.ratelimit import exchange_limits
+
+latency_buckets = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+# 交易所在响应头里返回的已用权重, 统一转小写后按前缀匹配
+used_weight_headers = ("x-mbx-used-weight", "x-sapi-used-ip-weight", "x-ratelimit-used")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.requests = {}
+            self.used_weight = {}
+
+    def record_request(
+        self, exchange, endpoint, weight=1, latency=0.0, error=None, headers=None
+    ):
+        with self.lock:
+            stat = self.requests.setdefault(
+                (exchange, endpoint),
+                {
+                    "count": 0,
+                    "errors": 0,
+                    "weight": 0,
+                    "latency_sum": 0.0,
+                    "latency_max": 0.0,
+                    "buckets": [0] * len(latency_buckets),
+                },
+            )
+            stat["count"] += 1
+            stat["errors"] += int(error is not None)
+            stat["weight"] += weight
+            stat["latency_sum"] += latency
+            stat["latency_max"] = max(stat["latency_max"], latency)
+            for i, bound in enumerate(latency_buckets):
+                if latency <= bound:
+                    stat["buckets"][i] += 1
+                    break
+            for name, value in (headers or {}).items():
+                name = name.lower()
+                if not name.startswith(used_weight_headers):
+                    continue
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    continue
+                used = self.used_weight.setdefault(
+                    (exchange, name), {"last": value, "max": value}
+                )
+                used["last"] = value
+                used["max"] = max(used["max"], value)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "started_at": self.started_at,
+                "elapsed": time.time() - self.started_at,
+                "requests": [
+                    {"exchange": exchange, "endpoint": endpoint, **stat}
+                    for (exchange, endpoint), stat in self.requests.items()
+                ],
+                "used_weight": [
+                    {"exchange": exchange, "header": header, **used}
+                    for (exchange, header), used in self.used_weight.items()
+                ],
+            }
+
+    def to_json(self):
+        return orjson.dumps(self.to_dict()).decode()
+
+    def to_prometheus(self):
+        lines = [
+            "# TYPE funcoin_requests_total counter",
+            "# TYPE funcoin_request_errors_total counter",
+            "# TYPE funcoin_request_weight_total counter",
+            "# TYPE funcoin_request_latency_seconds histogram",
+            "# TYPE funcoin_exchange_used_weight gauge",
+        ]
+        data = self.to_dict()
+        for stat in data["requests"]:
+            labels = f'exchange="{stat["exchange"]}",endpoint="{stat["endpoint"]}"'
+            lines.append(f"funcoin_requests_total{{{labels}}} {stat['count']}")
+            lines.append(f"funcoin_request_errors_total{{{labels}}} {stat['errors']}")
+            lines.append(f"funcoin_request_weight_total{{{labels}}} {stat['weight']}")
+            cumulative = 0
+            for bound, count in zip(latency_buckets, stat["buckets"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else bound
+                lines.append(
+                    f'funcoin_request_latency_seconds_bucket{{{labels},le="{le}"}} {cumulative}'
+                )
+            lines.append(
+                f"funcoin_request_latency_seconds_sum{{{labels}}} {stat['latency_sum']}"
+            )
+            lines.append(
+                f"funcoin_request_latency_seconds_count{{{labels}}} {stat['count']}"
+            )
+        for used in data["used_weight"]:
+            labels = f'exchange="{used["exchange"]}",header="{used["header"]}"'
+            lines.append(f"funcoin_exchange_used_weight{{{labels}}} {used['last']}")
+        return "\n".join(lines) + "\n"
+
+    def budget_report(self):
+        """按交易所汇总本次运行消耗的权重, 与交易所每分钟的额度对比"""
+        data = self.to_dict()
+        minutes = max(data["elapsed"], 1e-9) / 60
+        report = {}
+        for stat in data["requests"]:
+            item = report.setdefault(
+                stat["exchange"],
+                {"requests": 0, "errors": 0, "weight": 0, "latency_sum": 0.0},
+            )
+            for key in ("requests", "errors", "weight", "latency_sum"):
+                item[key] += stat["count" if key == "requests" else key]
+        for exchange, item in report.items():
+            limit, period = exchange_limits.get(exchange, (None, 60))
+            item["weight_per_minute"] = item["weight"] / minutes
+            item["limit_per_minute"] = limit * 60 / period if limit else None
+            if item["limit_per_minute"]:
+                item["utilization"] = (
+                    item["weight_per_minute"] / item["limit_per_minute"]
+                )
+            item["avg_latency"] = item.pop("latency_sum") / max(item["requests"], 1)
+            item["peak_used_weight"] = max(
+                [u["max"] for u in data["used_weight"] if u["exchange"] == exchange],
+                default=None,
+            )
+        return report
+
+    def write(self, path):
+        # 同时导出 JSON 和 Prometheus textfile
+        with open(path, "wb") as f:
+            f.write(
+                orjson.dumps(
+                    {**self.to_dict(), "budget": self.budget_report()},
+                    option=orjson.OPT_INDENT_2,
+                )
+            )
+        with open(f"{path}.prom", "w") as f:
+            f.write(self.to_prometheus())
+
+
+registry = MetricsRegistry()
+
+
+def _finish_request(span, latency, error, controller, headers, metrics, profiler):
+    status = span["status"]
+    if controller is not None:
+        controller.release(latency, error=error, status=status)
+    if error is None and status is not None and status >= 400:
+        error = status
+    if span["headers"] is None and headers is not None:
+        span["headers"] = headers()
+    if profiler is not None:
+        profiler.record("request", span["symbol"], wall=latency, requests=1)
+    (metrics or registry).record_request(
+        span["exchange"],
+        span["endpoint"],
+        span["weight"],
+        latency,
+        error,
+        span["headers"],
+    )
+
+
+@contextmanager
+def track_request(
+    exchange,
+    endpoint,
+    weight=1,
+    rate_limiter=None,
+    controller=None,
+    headers=None,
+    metrics=None,
+    profiler=None,
+    symbol=None,
+):
+    """包住一次 REST 请求: 按权重取令牌, 占用并发控制器的名额, 结束时归还名额并记录
+    延迟, 错误和已用权重.
+
+    with 块里可以设置 span["status"]/span["headers"]; headers 也可以是一个无参函数,
+    在请求结束后取值(比如 ccxt 的 last_response_headers).
+    """
+    if rate_limiter is not None:
+        rate_limiter.acquire(weight)
+    if controller is not None:
+        controller.acquire()
+    span = {
+        "exchange": exchange,
+        "endpoint": endpoint,
+        "weight": weight,
+        "symbol": symbol,
+        "status": None,
+        "headers": None,
+    }
+    start, error = time.time(), None
+    try:
+        yield span
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _finish_request(
+            span, time.time() - start, error, controller, headers, metrics, profiler
+        )
+
+
+@asynccontextmanager
+async def atrack_request(
+    exchange,
+    endpoint,
+    weight=1,
+    rate_limiter=None,
+    controller=None,
+    headers=None,
+    metrics=None,
+    profiler=None,
+    symbol=None,
+):
+    """track_request 的协程版本"""
+    if rate_limiter is not None:
+        await rate_limiter.acquire_async(weight)
+    if controller is not None:
+        await controller.acquire_async()
+    span = {
+        "exchange": exchange,
+        "endpoint": endpoint,
+        "weight": weight,
+        "symbol": symbol,
+        "status": None,
+        "headers": None,
+    }
+    start, error = time.time(), None
+    try:
+        yield span
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _finish_request(
+            span, time.time() - start, error, controller, headers, metrics, profiler
+        )
@@ -0,0 +1,187 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import orjson
+
+stage_fields = ("count", "wall_s", "cpu_s", "rows", "bytes", "requests")
+
+
+def _empty():
+    return dict.fromkeys(stage_fields, 0)
+
+
+class StageProfiler:
+    """按阶段和交易对累计耗时, CPU 时间, 行数, 字节数和请求数.
+
+    阶段之间是嵌套的: load_symbol 包含了它的 request/batch, write_data 包含 write.
+    CPU 时间是当前线程的 thread_time, 异步模式下多个协程交错执行, 只记墙钟时间.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.stages = {}
+            self.symbols = {}
+
+    def record(
+        self, stage, symbol=None, wall=0.0, cpu=0.0, rows=0, nbytes=0, requests=0
+    ):
+        with self.lock:
+            targets = [self.stages.setdefault(stage, _empty())]
+            if symbol is not None:
+                targets.append(
+                    self.symbols.setdefault(symbol, {}).setdefault(stage, _empty())
+                )
+            for stat in targets:
+                stat["count"] += 1
+                stat["wall_s"] += wall
+                stat["cpu_s"] += cpu
+                stat["rows"] += rows
+                stat["bytes"] += nbytes
+                stat["requests"] += requests
+
+    @contextmanager
+    def stage(self, name, symbol=None, rows=0, nbytes=0, cpu=True):
+        # 调用方可以在 with 块里补上 span["rows"]/span["bytes"]
+        span = {"rows": rows, "bytes": nbytes}
+        start, cpu_start = time.perf_counter(), time.thread_time() if cpu else 0.0
+        try:
+            yield span
+        finally:
+            self.record(
+                name,
+                symbol,
+                wall=time.perf_counter() - start,
+                cpu=time.thread_time() - cpu_start if cpu else 0.0,
+                rows=span["rows"],
+                nbytes=span["bytes"],
+            )
+
+    def to_dict(self, symbols=True):
+        with self.lock:
+            data = {
+                "started_at": self.started_at,
+                "elapsed": time.time() - self.started_at,
+                "stages": {name: dict(stat) for name, stat in self.stages.items()},
+            }
+            if symbols:
+                data["symbols"] = {
+                    symbol: {name: dict(stat) for name, stat in stages.items()}
+                    for symbol, stages in self.symbols.items()
+                }
+            return data
+
+    def to_json(self):
+        return orjson.dumps(self.to_dict()).decode()
+
+    def to_prometheus(self):
+        # 按交易对的明细基数太大, 只导出阶段汇总
+        lines = []
+        for field in stage_fields:
+            name = f"funcoin_stage_{field}_total"
+            lines.append(f"# TYPE {name} counter")
+            for stage, stat in self.to_dict(symbols=False)["stages"].items():
+                lines.append(f'{name}{{stage="{stage}"}} {stat[field]}')
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """一行一个阶段, 写日志用"""
+        return ", ".join(
+            f"{stage}: {stat['wall_s']:.1f}s wall {stat['cpu_s']:.1f}s cpu"
+            f" {stat['rows']} rows"
+            for stage, stat in self.to_dict(symbols=False)["stages"].items()
+        )
+
+    def write(self, path, prometheus=True):
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(self.to_dict(), option=orjson.OPT_INDENT_2))
+        if prometheus:
+            with open(f"{path}.prom", "w") as f:
+                f.write(self.to_prometheus())
+
+
+class SamplingProfiler:
+    """后台线程定时采样所有线程的调用栈, 按 flamegraph 的 collapsed 格式累计.
+
+    只在需要定位热点时打开, 采样间隔越小开销越大.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample(self):
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame))
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.samples += 1
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self._sample()
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return self
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def collapsed(self):
+        return "".join(
+            f"{stack} {count}\n"
+            for stack, count in sorted(self.counts.items(), key=lambda x: -x[1])
+        )
+
+    def top(self, n=20):
+        """按栈顶函数统计的自身耗时占比"""
+        leaf = {}
+        for stack, count in self.counts.items():
+            name = stack.rsplit(";", 1)[-1]
+            leaf[name] = leaf.get(name, 0) + count
+        total = max(sum(leaf.values()), 1)
+        return [
+            (name, count / total)
+            for name, count in sorted(leaf.items(), key=lambda x: -x[1])[:n]
+        ]
+
+    def write(self, path):
+        with open(path, "w") as f:
+            f.write(self.collapsed())
+
+
+profiler = StageProfiler()
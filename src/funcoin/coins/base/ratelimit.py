@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import struct
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("funcoin")
+
+# 每个交易所在 period 秒内允许的总权重
+exchange_limits = {"binance": (6000, 60), "binanceus": (6000, 60)}
+# 各接口的请求权重, 没有列出的按 1 计算
+endpoint_weights = {
+    "binance": {
+        "fetch_ohlcv": 2,
+        "fetch_trades": 4,
+        "fetch_tickers": 80,
+        "load_markets": 20,
+    },
+}
+endpoint_weights["binanceus"] = endpoint_weights["binance"]
+
+
+def endpoint_weight(exchange_id, endpoint):
+    return endpoint_weights.get(exchange_id, {}).get(endpoint, 1)
+
+
+class LocalBackend:
+    """进程内共享, 适用于同一进程里的多个线程和协程"""
+
+    def __init__(self):
+        self.mutex = threading.Lock()
+        self.state = None
+
+    @contextmanager
+    def locked(self):
+        with self.mutex:
+            yield
+
+    def read(self):
+        return self.state
+
+    def write(self, tokens, updated_at):
+        self.state = (tokens, updated_at)
+
+
+class FileBackend:
+    """用文件锁在同一台机器的多个进程之间共享令牌桶"""
+
+    state_format = "dd"
+
+    def __init__(self, path):
+        import fcntl
+
+        self.fcntl = fcntl
+        self.path = path
+        self.mutex = threading.Lock()
+        self.file = open(path, "a+b")
+
+    @contextmanager
+    def locked(self):
+        with self.mutex:
+            self.fcntl.flock(self.file.fileno(), self.fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self.fcntl.flock(self.file.fileno(), self.fcntl.LOCK_UN)
+
+    def read(self):
+        self.file.seek(0)
+        data = self.file.read(struct.calcsize(self.state_format))
+        if len(data) < struct.calcsize(self.state_format):
+            return None
+        return struct.unpack(self.state_format, data)
+
+    def write(self, tokens, updated_at):
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(struct.pack(self.state_format, tokens, updated_at))
+        self.file.flush()
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, backend=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.backend = backend or LocalBackend()
+
+    def _take(self, weight):
+        # 拿到令牌返回 0, 否则返回需要等待的秒数
+        weight = min(weight, self.capacity)
+        with self.backend.locked():
+            now = time.time()
+            state = self.backend.read()
+            tokens, updated_at = state if state is not None else (self.capacity, now)
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+            if tokens >= weight:
+                self.backend.write(tokens - weight, now)
+                return 0
+            self.backend.write(tokens, now)
+            return (weight - tokens) / self.rate
+
+    def acquire(self, weight=1):
+        wait = self._take(weight)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self._take(weight)
+
+    async def acquire_async(self, weight=1):
+        wait = self._take(weight)
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self._take(weight)
+
+
+_limiters = {}
+
+
+def get_rate_limiter(exchange_id, backend="file", limit=None, period=None, burst=5):
+    """同一进程内按交易所复用限流器, backend="file" 时跨进程共享.
+
+    桶容量只有 burst 秒的额度, 补充速度扣掉这部分, 任意 period 秒内发出的权重
+    (容量 + 补充) 都不超过 limit, 空闲之后也不会一下子打出两倍的额度.
+    """
+    key = (exchange_id, backend)
+    if key not in _limiters:
+        default_limit, default_period = exchange_limits.get(exchange_id, (1200, 60))
+        limit, period = limit or default_limit, period or default_period
+        if backend == "file":
+            path = os.path.join(
+                tempfile.gettempdir(), f"funcoin-ratelimit-{exchange_id}.bin"
+            )
+            try:
+                store = FileBackend(path)
+            except ImportError:
+                logger.warning("fcntl not available, rate limit is per process")
+                store = LocalBackend()
+        else:
+            store = LocalBackend()
+        capacity = limit * min(burst, period / 2) / period
+        _limiters[key] = TokenBucket((limit - capacity) / period, capacity, store)
+    return _limiters[key]
@@ -0,0 +1,142 @@
+import logging
+
+import numpy as np
+
+from funcoin.coins.base.batch import Batch, int_ids
+
+# side 存成一个 bit, True 是买
+side_bits = {"b": True, "s": False, "buy": True, "sell": False}
+# float32 列最多按 8 位小数校验
+max_decimals = 8
+
+logger = logging.getLogger("funcoin")
+
+
+class Schema:
+    """sink 落盘时每列的存储类型, 按列名决定.
+
+    symbol 存成分区内的字典加 int32 code, timestamp 存 int64 毫秒, side 存 bool,
+    id 在交易所全是整数时存 int64, float32 里的列存 float32, 其它存 float64.
+    每一列都检查转换是否无损, 不能无损转换时抛 ValueError, 不会悄悄丢精度.
+    id 的类型由第一批数据决定, 同一个文件里后面的批次必须一致.
+
+    float32 列按交易所的小数位数校验: 存下的 float32 按 decimals 位四舍五入后要等于
+    原值, 读的时候用 restore 还原. float32 可以是 {列名: 小数位数}, 只给列名时位数由
+    第一批数据决定. 某一批不满足时打 warning, 这一列之后都回退成 float64.
+    """
+
+    def __init__(self, fieldnames, float32=(), int_ids=None):
+        self.fieldnames = list(fieldnames)
+        self.float32 = set(float32)
+        self.decimals = dict(float32) if isinstance(float32, dict) else {}
+        # None 表示由第一批数据决定
+        self.int_ids = int_ids
+
+    def encode(self, batch):
+        """返回 {列名: ndarray}, symbol 列是 (codes, dictionary)"""
+        return {name: self._encode(name, batch) for name in self.fieldnames}
+
+    def _encode(self, name, batch):
+        if name == "symbol":
+            return encode_symbols(batch)
+        if name == "side":
+            return encode_sides(batch)
+        column = batch[name]
+        if name == "timestamp":
+            return _checked(column, np.int64, name)
+        if name == "id":
+            if self.int_ids is None:
+                self.int_ids = int_ids(column) is not None
+            if not self.int_ids:
+                return column
+            ids = int_ids(column)
+            if ids is None:
+                raise ValueError("trade ids are not all integers, use int_ids=False")
+            return ids
+        if name in self.float32:
+            return self._encode_float32(name, column)
+        return _checked(column, np.float64, name)
+
+    def _encode_float32(self, name, column):
+        converted = column.astype(np.float32)
+        if len(column) == 0:
+            return converted
+        if name not in self.decimals:
+            self.decimals[name] = precision(column)
+        decimals = self.decimals[name]
+        if decimals is not None and np.array_equal(
+            restore(converted, decimals), column, equal_nan=True
+        ):
+            return converted
+        logger.warning(
+            "column %s does not fit float32 at %s decimals, falling back to float64",
+            name,
+            decimals,
+        )
+        self.float32.discard(name)
+        return _checked(column, np.float64, name)
+
+    def decode(self, columns):
+        """encode 的逆过程, 还原成 {列名: ndarray} 的 batch"""
+        batch = {}
+        for name in self.fieldnames:
+            column = columns[name]
+            if name == "symbol":
+                codes, dictionary = column
+                column = np.asarray(dictionary, dtype=object)[codes]
+            elif name == "side":
+                column = np.where(column, "b", "s").astype(object)
+            elif name == "id" and column.dtype != object:
+                column = column.astype(str).astype(object)
+            elif column.dtype == np.float32:
+                if self.decimals.get(name) is not None:
+                    column = restore(column, self.decimals[name])
+                else:
+                    column = column.astype(np.float64)
+            batch[name] = column
+        return batch
+
+
+def encode_symbols(batch):
+    if isinstance(batch, Batch):
+        return batch.codes["symbol"], batch.dictionaries["symbol"]
+    dictionary, codes = np.unique(batch["symbol"], return_inverse=True)
+    return codes.astype(np.int32), dictionary
+
+
+def encode_sides(batch):
+    try:
+        if isinstance(batch, Batch):
+            # 只查字典里的几个值, 再按 code 展开
+            bits = np.array(
+                [side_bits[side] for side in batch.dictionaries["side"].tolist()],
+                dtype=bool,
+            )
+            return bits[batch.codes["side"]]
+        return np.array(
+            [side_bits[side] for side in batch["side"].tolist()], dtype=bool
+        )
+    except KeyError as e:
+        raise ValueError(f"unknown trade side: {e}") from None
+
+
+def precision(column):
+    """column 的小数位数, 超过 max_decimals 位时返回 None"""
+    values = column.astype(np.float64)
+    for decimals in range(max_decimals + 1):
+        if np.array_equal(restore(values, decimals), values, equal_nan=True):
+            return decimals
+    return None
+
+
+def restore(column, decimals):
+    """按 decimals 位小数四舍五入成 float64, float32 列读出来后用它还原原值"""
+    scale = 10.0**decimals
+    return np.round(column.astype(np.float64) * scale) / scale
+
+
+def _checked(column, dtype, name):
+    converted = column.astype(dtype)
+    if not np.array_equal(converted, column, equal_nan=converted.dtype.kind == "f"):
+        raise ValueError(f"column {name} is not lossless as {np.dtype(dtype).name}")
+    return converted
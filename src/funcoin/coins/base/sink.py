@@ -0,0 +1,276 @@
+import csv
+import gzip
+import io
+import lzma
+import os
+
+import numpy as np
+import orjson
+
+from funcoin.coins.base.batch import Batch
+from funcoin.coins.base.schema import Schema, restore
+from funcoin.coins.base.tscodec import encode_block, magic
+
+
+class BaseSink:
+    # 是否支持断点续传时在已有文件后追加
+    appendable = False
+
+    def __init__(self, fieldnames, *args, **kwargs):
+        self.fieldnames = fieldnames
+
+    def write(self, batch):
+        pass
+
+    def size(self):
+        # 已经落盘的字节数, 压缩流和 parquet 会有缓冲, 只是近似值
+        return 0
+
+    def close(self):
+        pass
+
+
+codec_suffix = {"xz": "xz", "gzip": "gz", "zstd": "zst"}
+
+
+def open_text(path, mode="w", codec=None, level=None, threads=-1):
+    """按 codec 打开一个边写边压缩的文本流, codec=None 时就是普通文件"""
+    if codec is None:
+        return open(path, mode=mode, newline="")
+    if codec == "gzip":
+        return gzip.open(path, f"{mode}t", compresslevel=level or 6, newline="")
+    if codec == "xz":
+        return lzma.open(path, f"{mode}t", preset=level or 6, newline="")
+    if codec == "zstd":
+        import zstandard
+
+        compressor = zstandard.ZstdCompressor(level=level or 10, threads=threads)
+        stream = compressor.stream_writer(open(path, f"{mode}b"), closefd=True)
+        return io.TextIOWrapper(stream, newline="")
+    raise ValueError(f"unknown codec: {codec}")
+
+
+class CSVSink(BaseSink):
+    def __init__(
+        self,
+        csv_path,
+        fieldnames,
+        *args,
+        append=False,
+        codec=None,
+        level=None,
+        threads=-1,
+        **kwargs,
+    ):
+        super().__init__(fieldnames, *args, **kwargs)
+        self.csv_path = csv_path
+        self.codec = codec
+        # 压缩流中途断掉会留下不完整的帧, 只有未压缩的 csv 才能续写
+        self.appendable = codec is None
+        append = (
+            append
+            and self.appendable
+            and os.path.exists(csv_path)
+            and os.path.getsize(csv_path) > 0
+        )
+        self.csv_file = open_text(
+            self.csv_path, "a" if append else "w", codec, level, threads
+        )
+        self.csv_writer = csv.writer(self.csv_file, delimiter=",")
+        if not append:
+            self.csv_writer.writerow(self.fieldnames)
+
+    def write(self, batch):
+        # 按列取值后 zip 成行元组, 不构造逐行的 dict
+        columns = [batch[name].tolist() for name in self.fieldnames]
+        self.csv_writer.writerows(zip(*columns))
+        if self.codec is None:
+            # 压缩流频繁 flush 会切断压缩块, 只对普通文件及时落盘
+            self.csv_file.flush()
+
+    def size(self):
+        return os.path.getsize(self.csv_path)
+
+    def close(self):
+        self.csv_file.close()
+
+
+class ParquetSink(BaseSink):
+    def __init__(
+        self,
+        parquet_path,
+        fieldnames,
+        *args,
+        row_group_size=1000000,
+        compression="zstd",
+        schema=None,
+        **kwargs,
+    ):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        super().__init__(fieldnames, *args, **kwargs)
+        self.pa = pa
+        self.pq = pq
+        self.parquet_path = parquet_path
+        self.row_group_size = row_group_size
+        self.compression = compression
+        # 按 schema 存成有类型的列: id 是 int64, side 是 bool
+        self.schema = schema or Schema(fieldnames)
+        self.parquet_writer = None
+        # 最近一批里出现的 symbol 可能还没下载完, 先留着, 凑成完整的 row group 再写
+        self.pending = {}
+
+    def _table(self, batch):
+        arrays = []
+        for name, column in self.schema.encode(batch).items():
+            if name == "symbol":
+                codes, dictionary = column
+                arrays.append(
+                    self.pa.DictionaryArray.from_arrays(
+                        codes, self.pa.array(dictionary, self.pa.string())
+                    )
+                )
+            elif column.dtype == object:
+                arrays.append(self.pa.array(column, self.pa.string()))
+            else:
+                arrays.append(self.pa.array(column))
+        return self.pa.Table.from_arrays(arrays, names=self.fieldnames)
+
+    def _widen(self, table):
+        # 回退成 float64 之前按 float32 存的列, 按小数位数还原后转成 float64
+        for i, field in enumerate(table.schema):
+            if (
+                field.type == self.pa.float32()
+                and field.name not in self.schema.float32
+            ):
+                column = restore(
+                    table.column(i).to_numpy(), self.schema.decimals[field.name]
+                )
+                table = table.set_column(i, field.name, self.pa.array(column))
+        return table
+
+    def _write_table(self, table):
+        if self.parquet_writer is not None and not table.schema.equals(
+            self.parquet_writer.schema, check_metadata=False
+        ):
+            # 有 float32 列回退成了 float64, 已经写下的部分读回来转换后重写一遍
+            self.parquet_writer.close()
+            self.parquet_writer = None
+            self._write_table(self._widen(self.pq.read_table(self.parquet_path)))
+        if self.parquet_writer is None:
+            decimals = {
+                name: self.schema.decimals.get(name)
+                for name in table.column_names
+                if table.schema.field(name).type == self.pa.float32()
+            }
+            self.parquet_writer = self.pq.ParquetWriter(
+                self.parquet_path,
+                # 读的人按这里的小数位数把 float32 还原成原值
+                table.schema.with_metadata(
+                    {"funcoin.decimals": orjson.dumps(decimals)}
+                ),
+                compression=self.compression,
+                use_dictionary=["symbol"],
+                # 递增的 id 和时间戳差分后再压缩, 比直接压缩 int64 小得多
+                column_encoding={
+                    name: "DELTA_BINARY_PACKED"
+                    for name in table.column_names
+                    if self.pa.types.is_integer(table.schema.field(name).type)
+                },
+                write_statistics=True,
+            )
+        self.parquet_writer.write_table(table, row_group_size=self.row_group_size)
+
+    def _flush_symbols(self, symbols):
+        for symbol in symbols:
+            tables = [self._widen(table) for table in self.pending.pop(symbol)]
+            self._write_table(self.pa.concat_tables(tables).combine_chunks())
+
+    def write(self, batch):
+        if len(batch["timestamp"]) == 0:
+            return
+        table = self._table(batch)
+        # 按 symbol 切段, Batch 直接比较 code
+        if isinstance(batch, Batch):
+            keys, names = batch.codes["symbol"], batch.dictionaries["symbol"]
+        else:
+            keys, names = batch["symbol"], None
+        starts = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+        bounds = [0, *starts.tolist(), len(keys)]
+        current = set()
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            symbol = keys[start] if names is None else names[keys[start]]
+            current.add(symbol)
+            self.pending.setdefault(symbol, []).append(table.slice(start, end - start))
+        self._flush_symbols(
+            [symbol for symbol in self.pending if symbol not in current]
+        )
+        for symbol in current:
+            if sum(len(t) for t in self.pending[symbol]) >= self.row_group_size:
+                self._flush_symbols([symbol])
+
+    def size(self):
+        if self.parquet_writer is None:
+            return 0
+        return os.path.getsize(self.parquet_path)
+
+    def _empty_batch(self):
+        # 字符串列是 object, 其它和 loader 产生的 batch 一致
+        dtypes = {"symbol": object, "id": object, "side": object, "timestamp": np.int64}
+        return {
+            name: np.array([], dtype=dtypes.get(name, np.float64))
+            for name in self.fieldnames
+        }
+
+    def close(self):
+        self._flush_symbols(list(self.pending))
+        if self.parquet_writer is None:
+            # 一行都没写时也要生成带 schema 的空文件, 调用方会去 rename/上传它
+            self._write_table(self._table(self._empty_batch()))
+        self.parquet_writer.close()
+
+
+class TimeSeriesSink(BaseSink):
+    """funcoin.coins.base.tscodec 的列式时间序列格式, 每批数据追加成一个块"""
+
+    def __init__(self, tsc_path, fieldnames, *args, schema=None, level=3, **kwargs):
+        super().__init__(fieldnames, *args, **kwargs)
+        self.tsc_path = tsc_path
+        self.level = level
+        self.schema = schema or Schema(fieldnames)
+        self.tsc_file = open(tsc_path, "wb")
+        self.tsc_file.write(magic)
+
+    def write(self, batch):
+        rows = len(batch["timestamp"])
+        if rows == 0:
+            return
+        columns = self.schema.encode(batch)
+        self.tsc_file.write(
+            encode_block(columns, rows, self.level, decimals=self.schema.decimals)
+        )
+        self.tsc_file.flush()
+
+    def size(self):
+        return self.tsc_file.tell()
+
+    def close(self):
+        self.tsc_file.close()
+
+
+def open_sink(
+    fieldnames,
+    csv_path=None,
+    parquet_path=None,
+    append=False,
+    codec=None,
+    schema=None,
+    tsc_path=None,
+    **kwargs,
+):
+    if parquet_path is not None:
+        return ParquetSink(parquet_path, fieldnames, schema=schema, **kwargs)
+    if tsc_path is not None:
+        return TimeSeriesSink(tsc_path, fieldnames, schema=schema, **kwargs)
+    return CSVSink(csv_path, fieldnames, append=append, codec=codec, **kwargs)
@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+def default_db_path():
+    return os.path.join(os.path.expanduser("~"), ".cache", "funcoin", "funcoin.db")
+
+
+class SQLiteStore:
+    table_sql = ""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or default_db_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, timeout=60, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript(self.table_sql)
+
+    def execute(self, sql, params=()):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params).fetchall()
+
+    def executemany(self, sql, params_list):
+        with self.lock, self.conn:
+            self.conn.executemany(sql, params_list)
+
+    def close(self):
+        self.conn.close()
+
+
+class CheckpointStore(SQLiteStore):
+    table_sql = """
+    CREATE TABLE IF NOT EXISTS checkpoint (
+        task TEXT NOT NULL,
+        symbol TEXT NOT NULL,
+        cursor INTEGER,
+        last_id TEXT,
+        done INTEGER NOT NULL DEFAULT 0,
+        updated_at REAL,
+        PRIMARY KEY (task, symbol)
+    );
+    """
+
+    def load(self, task):
+        rows = self.execute(
+            "SELECT symbol, cursor, last_id, done FROM checkpoint WHERE task = ?",
+            (task,),
+        )
+        return {
+            symbol: (cursor, last_id, bool(done))
+            for symbol, cursor, last_id, done in rows
+        }
+
+    def save(self, task, cursors):
+        now = time.time()
+        self.executemany(
+            "INSERT OR REPLACE INTO checkpoint VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (task, symbol, cursor, last_id, int(done), now)
+                for symbol, (cursor, last_id, done) in cursors.items()
+            ],
+        )
+
+    def clear(self, task):
+        self.execute("DELETE FROM checkpoint WHERE task = ?", (task,))
@@ -0,0 +1,410 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from funcoin.coins.base.store import SQLiteStore
+
+logger = logging.getLogger("funcoin")
+
+STATUSES = ("pending", "leased", "done", "dead")
+
+
+def job_key(job):
+    return f"{job['exchange']}|{job['data_type']}|{job['day']}"
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class MemoryQueueBackend:
+    """进程内的队列, 用于单机调试和测试"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def publish(self, jobs):
+        added = 0
+        with self.lock:
+            for job_id, priority, payload in jobs:
+                if job_id in self.jobs:
+                    continue
+                self.jobs[job_id] = {
+                    "priority": priority,
+                    "payload": payload,
+                    "status": "pending",
+                    "attempts": 0,
+                    "worker": None,
+                    "lease_until": 0,
+                    "available_at": 0,
+                    "error": None,
+                }
+                added += 1
+        return added
+
+    def lease(self, worker, now, lease_until, max_attempts):
+        with self.lock:
+            for job in self.jobs.values():
+                if job["status"] == "leased" and job["lease_until"] < now:
+                    job["status"] = (
+                        "dead" if job["attempts"] >= max_attempts else "pending"
+                    )
+            ready = [
+                (job["priority"], job_id)
+                for job_id, job in self.jobs.items()
+                if job["status"] == "pending" and job["available_at"] <= now
+            ]
+            if not ready:
+                return None
+            job_id = max(ready)[1]
+            job = self.jobs[job_id]
+            job.update(status="leased", worker=worker, lease_until=lease_until)
+            job["attempts"] += 1
+            return job_id, job["payload"], job["attempts"]
+
+    def _owned(self, job_id, worker):
+        job = self.jobs.get(job_id)
+        if job is None or job["status"] != "leased" or job["worker"] != worker:
+            return None
+        return job
+
+    def heartbeat(self, job_id, worker, lease_until):
+        with self.lock:
+            job = self._owned(job_id, worker)
+            if job is not None:
+                job["lease_until"] = lease_until
+            return job is not None
+
+    def complete(self, job_id, worker):
+        with self.lock:
+            job = self._owned(job_id, worker)
+            if job is not None:
+                job["status"] = "done"
+            return job is not None
+
+    def fail(self, job_id, worker, error, available_at, max_attempts):
+        with self.lock:
+            job = self._owned(job_id, worker)
+            if job is not None:
+                job["status"] = "dead" if job["attempts"] >= max_attempts else "pending"
+                job.update(available_at=available_at, error=error)
+            return job is not None
+
+    def stats(self):
+        with self.lock:
+            counts = dict.fromkeys(STATUSES, 0)
+            for job in self.jobs.values():
+                counts[job["status"]] += 1
+            return counts
+
+
+class SQLiteQueueBackend(SQLiteStore):
+    """单机多进程共用的队列, 状态变更都带条件更新, 并发 lease 不会拿到同一个任务"""
+
+    table_sql = """
+    CREATE TABLE IF NOT EXISTS work_queue (
+        job_id TEXT PRIMARY KEY,
+        priority INTEGER NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        lease_until REAL NOT NULL DEFAULT 0,
+        available_at REAL NOT NULL DEFAULT 0,
+        error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS work_queue_ready
+        ON work_queue (status, priority);
+    """
+
+    def _update(self, sql, params):
+        with self.lock, self.conn:
+            return self.conn.execute(sql, params).rowcount > 0
+
+    def publish(self, jobs):
+        with self.lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO work_queue (job_id, priority, payload, status)"
+                " VALUES (?, ?, ?, 'pending')",
+                jobs,
+            )
+            return self.conn.total_changes - before
+
+    def lease(self, worker, now, lease_until, max_attempts):
+        self.execute(
+            "UPDATE work_queue SET status = CASE WHEN attempts >= ? THEN 'dead'"
+            " ELSE 'pending' END WHERE status = 'leased' AND lease_until < ?",
+            (max_attempts, now),
+        )
+        while True:
+            rows = self.execute(
+                "SELECT job_id, payload, attempts FROM work_queue"
+                " WHERE status = 'pending' AND available_at <= ?"
+                " ORDER BY priority DESC LIMIT 1",
+                (now,),
+            )
+            if not rows:
+                return None
+            job_id, payload, attempts = rows[0]
+            # 别的进程可能抢先 lease 了同一行, 条件更新失败就重新挑
+            if self._update(
+                "UPDATE work_queue SET status = 'leased', worker = ?,"
+                " lease_until = ?, attempts = attempts + 1"
+                " WHERE job_id = ? AND status = 'pending' AND attempts = ?",
+                (worker, lease_until, job_id, attempts),
+            ):
+                return job_id, payload, attempts + 1
+
+    def heartbeat(self, job_id, worker, lease_until):
+        return self._update(
+            "UPDATE work_queue SET lease_until = ?"
+            " WHERE job_id = ? AND worker = ? AND status = 'leased'",
+            (lease_until, job_id, worker),
+        )
+
+    def complete(self, job_id, worker):
+        return self._update(
+            "UPDATE work_queue SET status = 'done'"
+            " WHERE job_id = ? AND worker = ? AND status = 'leased'",
+            (job_id, worker),
+        )
+
+    def fail(self, job_id, worker, error, available_at, max_attempts):
+        return self._update(
+            "UPDATE work_queue SET status = CASE WHEN attempts >= ? THEN 'dead'"
+            " ELSE 'pending' END, available_at = ?, error = ?"
+            " WHERE job_id = ? AND worker = ? AND status = 'leased'",
+            (max_attempts, available_at, error, job_id, worker),
+        )
+
+    def stats(self):
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(
+            self.execute("SELECT status, COUNT(*) FROM work_queue GROUP BY status")
+        )
+        return counts
+
+
+# 到期的延迟任务和过期的 lease 先放回 pending, 再弹出优先级最高的任务
+_redis_lease = """
+local prefix = KEYS[1]
+local now = tonumber(ARGV[1])
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', prefix .. ':delayed', '-inf', now)) do
+    redis.call('ZREM', prefix .. ':delayed', id)
+    redis.call('ZADD', prefix .. ':pending',
+        redis.call('HGET', prefix .. ':job:' .. id, 'priority'), id)
+end
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', prefix .. ':leased', '-inf', now)) do
+    local key = prefix .. ':job:' .. id
+    redis.call('ZREM', prefix .. ':leased', id)
+    if tonumber(redis.call('HGET', key, 'attempts')) >= tonumber(ARGV[4]) then
+        redis.call('HSET', key, 'status', 'dead')
+    else
+        redis.call('HSET', key, 'status', 'pending')
+        redis.call('ZADD', prefix .. ':pending', redis.call('HGET', key, 'priority'), id)
+    end
+end
+local top = redis.call('ZPOPMAX', prefix .. ':pending')
+if #top == 0 then
+    return false
+end
+local id = top[1]
+local key = prefix .. ':job:' .. id
+redis.call('ZADD', prefix .. ':leased', ARGV[2], id)
+redis.call('HSET', key, 'status', 'leased', 'worker', ARGV[3])
+local attempts = redis.call('HINCRBY', key, 'attempts', 1)
+return {id, redis.call('HGET', key, 'payload'), attempts}
+"""
+
+# ARGV[1]=job_id ARGV[2]=worker ARGV[3]=动作 ARGV[4..]=参数
+_redis_update = """
+local prefix = KEYS[1]
+local id = ARGV[1]
+local key = prefix .. ':job:' .. id
+if redis.call('HGET', key, 'status') ~= 'leased'
+    or redis.call('HGET', key, 'worker') ~= ARGV[2] then
+    return 0
+end
+if ARGV[3] == 'heartbeat' then
+    redis.call('ZADD', prefix .. ':leased', ARGV[4], id)
+    return 1
+end
+redis.call('ZREM', prefix .. ':leased', id)
+if ARGV[3] == 'complete' then
+    redis.call('HSET', key, 'status', 'done')
+    return 1
+end
+redis.call('HSET', key, 'error', ARGV[6])
+if tonumber(redis.call('HGET', key, 'attempts')) >= tonumber(ARGV[5]) then
+    redis.call('HSET', key, 'status', 'dead')
+else
+    redis.call('HSET', key, 'status', 'pending')
+    redis.call('ZADD', prefix .. ':delayed', ARGV[4], id)
+end
+return 1
+"""
+
+_redis_publish = """
+local prefix = KEYS[1]
+local added = 0
+for i = 1, #ARGV, 3 do
+    local key = prefix .. ':job:' .. ARGV[i]
+    if redis.call('EXISTS', key) == 0 then
+        redis.call('HSET', key, 'priority', ARGV[i + 1], 'payload', ARGV[i + 2],
+            'status', 'pending', 'attempts', 0)
+        redis.call('ZADD', prefix .. ':pending', ARGV[i + 1], ARGV[i])
+        added = added + 1
+    end
+end
+return added
+"""
+
+
+class RedisQueueBackend:
+    """多节点共用的队列, 每个操作是一段 lua 脚本, 在 redis 端原子执行"""
+
+    def __init__(self, url="redis://localhost:6379/0", prefix="funcoin:queue"):
+        import redis
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self._lease = self.client.register_script(_redis_lease)
+        self._update = self.client.register_script(_redis_update)
+        self._publish = self.client.register_script(_redis_publish)
+
+    def publish(self, jobs):
+        args = [value for job in jobs for value in job]
+        return int(self._publish(keys=[self.prefix], args=args)) if args else 0
+
+    def lease(self, worker, now, lease_until, max_attempts):
+        result = self._lease(
+            keys=[self.prefix], args=[now, lease_until, worker, max_attempts]
+        )
+        if not result:
+            return None
+        job_id, payload, attempts = result
+        return job_id, payload, int(attempts)
+
+    def heartbeat(self, job_id, worker, lease_until):
+        args = [job_id, worker, "heartbeat", lease_until]
+        return self._update(keys=[self.prefix], args=args) == 1
+
+    def complete(self, job_id, worker):
+        return self._update(keys=[self.prefix], args=[job_id, worker, "complete"]) == 1
+
+    def fail(self, job_id, worker, error, available_at, max_attempts):
+        args = [job_id, worker, "fail", available_at, max_attempts, error]
+        return self._update(keys=[self.prefix], args=args) == 1
+
+    def stats(self):
+        counts = dict.fromkeys(STATUSES, 0)
+        for key in self.client.scan_iter(f"{self.prefix}:job:*"):
+            counts[self.client.hget(key, "status")] += 1
+        return counts
+
+
+def open_queue_backend(url=None):
+    """memory:// | sqlite:///path/to.db | redis://host:port/db"""
+    if url is None or url.startswith("sqlite://"):
+        path = url[len("sqlite://") :] if url else None
+        return SQLiteQueueBackend(path or None)
+    if url.startswith("memory://"):
+        return MemoryQueueBackend()
+    if url.startswith(("redis://", "rediss://")):
+        return RedisQueueBackend(url)
+    raise ValueError(f"unknown queue url: {url}")
+
+
+class WorkQueue:
+    """(交易所, 数据类型, 日期) 粒度的任务队列.
+
+    worker lease 一个任务后在后台定期 heartbeat 续约, 进程挂掉后 lease 过期,
+    任务会被其它 worker 重新领取; 失败的任务延迟 retry_delay 秒后重试,
+    超过 max_attempts 次标记为 dead.
+    """
+
+    def __init__(self, backend=None, lease_seconds=600, max_attempts=5, retry_delay=60):
+        if backend is None or isinstance(backend, str):
+            backend = open_queue_backend(backend)
+        self.backend = backend
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def publish(self, jobs):
+        # 同一个任务重复发布会被忽略, 优先级是日期, 最近的天先做
+        return self.backend.publish(
+            [
+                (job_key(job), int(job["day"]), json.dumps(job, sort_keys=True))
+                for job in jobs
+            ]
+        )
+
+    def lease(self, worker):
+        now = time.time()
+        result = self.backend.lease(
+            worker, now, now + self.lease_seconds, self.max_attempts
+        )
+        if result is None:
+            return None
+        job_id, payload, attempts = result
+        return job_id, json.loads(payload), attempts
+
+    def heartbeat(self, job_id, worker):
+        return self.backend.heartbeat(job_id, worker, time.time() + self.lease_seconds)
+
+    def complete(self, job_id, worker):
+        return self.backend.complete(job_id, worker)
+
+    def fail(self, job_id, worker, error):
+        return self.backend.fail(
+            job_id,
+            worker,
+            error,
+            time.time() + self.retry_delay,
+            self.max_attempts,
+        )
+
+    def stats(self):
+        return self.backend.stats()
+
+    def _keep_alive(self, job_id, worker, stop):
+        while not stop.wait(self.lease_seconds / 3):
+            if not self.heartbeat(job_id, worker):
+                logger.warning(f"lease on {job_id} lost by {worker}")
+                return
+
+    def work(self, handler, worker=None, idle_sleep=10, stop_when_empty=True):
+        """循环领取任务交给 handler(job) 处理, 返回处理成功的任务数"""
+        worker = worker or default_worker_id()
+        done = 0
+        while True:
+            leased = self.lease(worker)
+            if leased is None:
+                if stop_when_empty:
+                    return done
+                time.sleep(idle_sleep)
+                continue
+            job_id, job, attempts = leased
+            logger.info(f"{worker} leased {job_id}, attempt {attempts}")
+            stop = threading.Event()
+            beat = threading.Thread(
+                target=self._keep_alive, args=(job_id, worker, stop), daemon=True
+            )
+            beat.start()
+            try:
+                handler(job)
+            except Exception as e:
+                logger.error(f"{job_id} failed on {worker}: {e}")
+                self.fail(job_id, worker, repr(e))
+                continue
+            finally:
+                stop.set()
+                beat.join()
+            self.complete(job_id, worker)
+            done += 1
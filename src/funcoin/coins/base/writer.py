@@ -0,0 +1,86 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("funcoin")
+
+
+class BackgroundWriter:
+    """后台线程写 sink: 前台继续攒下一批, 后台写上一批.
+
+    已提交但还没写完的数据超过 max_bytes 时 submit 会阻塞(背压), 内存不会无限增长;
+    写线程的异常在下一次 submit/flush 时抛回前台.
+    """
+
+    def __init__(self, write, max_bytes=256 << 20):
+        self.write = write
+        self.max_bytes = max_bytes
+        self.items = deque()
+        self.pending_bytes = 0
+        self.busy = False
+        self.error = None
+        self.closed = False
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, item, nbytes=0):
+        """返回因为背压等待的秒数"""
+        start = time.perf_counter()
+        with self.cond:
+            self._raise()
+            # 队列为空时总能提交, 单批超过上限也不会卡死
+            while (
+                self.pending_bytes > 0 and self.pending_bytes + nbytes > self.max_bytes
+            ):
+                self.cond.wait()
+                self._raise()
+            self.items.append((item, nbytes))
+            self.pending_bytes += nbytes
+            self.cond.notify_all()
+        return time.perf_counter() - start
+
+    def flush(self):
+        with self.cond:
+            while self.items or self.busy:
+                self.cond.wait()
+            self._raise()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self.cond:
+                self.closed = True
+                self.cond.notify_all()
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.items and not self.closed:
+                    self.cond.wait()
+                if not self.items:
+                    return
+                item, nbytes = self.items.popleft()
+                self.busy = True
+            try:
+                self.write(item)
+            except Exception as e:
+                logger.error(f"background write failed: {e}")
+                with self.cond:
+                    # 后面的数据依赖这一批的 cursor, 出错后丢弃, 由前台决定怎么处理
+                    self.error = e
+                    self.items.clear()
+                    self.pending_bytes = 0
+            finally:
+                with self.cond:
+                    self.busy = False
+                    self.pending_bytes = max(0, self.pending_bytes - nbytes)
+                    self.cond.notify_all()
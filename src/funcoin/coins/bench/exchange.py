@@ -0,0 +1,287 @@
+"""离线压测用的假交易所, 接口和 loader/MarketIndex 用到的 ccxt 方法一致.
+
+K 线和成交由 (交易对, 时间/成交 id) 的哈希生成, 同样的请求永远返回同样的数据;
+可以配置延迟, 错误率, 分页上限和按权重的限流(超出时抛 RateLimitExceeded).
+"""
+
+import asyncio
+import math
+import random
+import threading
+import time
+import zlib
+
+import ccxt
+import numpy as np
+
+from funcoin.coins.base.ratelimit import endpoint_weight
+
+_G = np.uint64(0x9E3779B97F4A7C15)
+_M1 = np.uint64(0xBF58476D1CE4E5B9)
+_M2 = np.uint64(0x94D049BB133111EB)
+
+one_day = 24 * 60 * 60 * 1000
+one_week = 7 * one_day
+# 2017-07-14, 所有交易对在这之后上线
+epoch = 1499990400000
+
+
+def uniform(key, values):
+    """splitmix64, 对每个 (key, value) 给出确定的 [0, 1) 伪随机数"""
+    with np.errstate(over="ignore"):
+        x = np.asarray(values, dtype=np.int64).astype(np.uint64) * _G + np.uint64(key)
+        x = (x ^ (x >> np.uint64(30))) * _M1
+        x = (x ^ (x >> np.uint64(27))) * _M2
+        x = x ^ (x >> np.uint64(31))
+    return (x >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+class FakeExchange:
+    def __init__(
+        self,
+        symbols=1000,
+        exchange_id="binance",
+        seed=0,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        weight_limit=None,
+        ohlcv_limit=1000,
+        trade_limit=1000,
+        trade_interval=3000,
+        delisted_ratio=0.0,
+        now=None,
+    ):
+        self.id = exchange_id
+        self.name = exchange_id.capitalize()
+        self.apiKey = None
+        self.secret = None
+        self.seed = seed
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        # 每分钟的请求权重上限, None 表示不限流
+        self.weight_limit = weight_limit
+        self.ohlcv_limit = ohlcv_limit
+        self.trade_limit = trade_limit
+        self.now = now
+        self.features = {"spot": {"fetchOHLCV": {"limit": ohlcv_limit}}}
+        self.last_response_headers = {}
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.window = (0, 0)
+        self.requests = {}
+        self.rows = 0
+
+        self.info = {}
+        for i in range(symbols):
+            symbol = f"C{i:04d}/USDT"
+            key = zlib.crc32(symbol.encode()) ^ seed
+            u = uniform(key, np.arange(5))
+            listed_at = epoch + int(u[0] * 6 * 365) * one_day
+            delisted = u[1] < delisted_ratio
+            price = 10 ** (u[2] * 7 - 3)
+            self.info[symbol] = {
+                "key": key,
+                "listed_at": listed_at,
+                # 下架的交易对在上线后一段时间内停止交易
+                "end": listed_at + int(u[3] * 365) * one_day if delisted else None,
+                "price": price,
+                "decimals": int(min(max(5 - math.floor(math.log10(price)), 0), 8)),
+                # 成交间隔按交易对从 trade_interval/10 到 trade_interval*10 分布
+                "interval": max(1, int(trade_interval * 10 ** (u[4] * 2 - 1))),
+            }
+        self.markets = {
+            symbol: {
+                "symbol": symbol,
+                "active": info["end"] is None,
+                "created": None,
+            }
+            for symbol, info in self.info.items()
+        }
+        # 一个合约交易对, loader 应该跳过
+        self.markets["C0000/USDT:USDT"] = {"symbol": "C0000/USDT:USDT", "active": True}
+        self.currencies = {}
+        self.symbols = sorted(self.markets)
+
+    def load_markets(self, reload=False):
+        return self.markets
+
+    def set_markets(self, markets, currencies=None):
+        self.markets = markets
+        self.symbols = sorted(markets)
+
+    def milliseconds(self):
+        return self.now if self.now is not None else int(time.time() * 1000)
+
+    parse_timeframe = staticmethod(ccxt.Exchange.parse_timeframe)
+    sort_by = staticmethod(ccxt.Exchange.sort_by)
+
+    def sleep(self, milliseconds):
+        time.sleep(milliseconds / 1000)
+
+    def close(self):
+        pass
+
+    def _delay(self):
+        with self.lock:
+            return self.latency + self.jitter * self.random.random()
+
+    def _check(self, method):
+        """记录请求, 按配置返回限流或网络错误"""
+        weight = endpoint_weight(self.id, method)
+        with self.lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+            minute = int(time.time() // 60)
+            used = (self.window[1] if self.window[0] == minute else 0) + weight
+            self.window = (minute, used)
+            self.last_response_headers = {"x-mbx-used-weight-1m": str(used)}
+            if self.weight_limit is not None and used > self.weight_limit:
+                raise ccxt.RateLimitExceeded(f"{self.id} 429 used weight {used}")
+            if self.random.random() < self.error_rate:
+                raise ccxt.RequestTimeout(f"{self.id} fake timeout on {method}")
+
+    def _serve(self, rows):
+        with self.lock:
+            self.rows += len(rows)
+        return rows
+
+    def _range(self, symbol):
+        info = self.info[symbol]
+        end = self.milliseconds() if info["end"] is None else info["end"]
+        return info, info["listed_at"], min(end, self.milliseconds())
+
+    def _ohlcv(self, symbol, timeframe="1m", since=None, limit=None):
+        tf = self.parse_timeframe(timeframe) * 1000
+        info, start, end = self._range(symbol)
+        limit = min(limit or self.ohlcv_limit, self.ohlcv_limit)
+        if since is None:
+            # 不带 since 返回最近的 limit 根
+            first = (end // tf - limit) * tf
+        else:
+            first = -(-since // tf) * tf
+        first = max(first, -(-start // tf) * tf)
+        # 只返回已经开始的 K 线
+        timestamp = np.arange(first, min(first + limit * tf, end), tf, dtype=np.int64)
+        if len(timestamp) == 0:
+            return []
+        key, scale = info["key"], 10 ** info["decimals"]
+
+        def mid(ts):
+            wave = 0.05 * np.sin(2 * np.pi * ts / one_week + key % 7)
+            noise = 0.01 * (uniform(key, ts // 1000) - 0.5)
+            return np.round(info["price"] * np.exp(wave + noise) * scale) / scale
+
+        open_, close = mid(timestamp), mid(timestamp + tf)
+        spread = 0.002 * uniform(key + 1, timestamp)
+        high = np.round(np.maximum(open_, close) * (1 + spread) * scale) / scale
+        low = np.round(np.minimum(open_, close) * (1 - spread) * scale) / scale
+        vol = np.round(1000 * uniform(key + 2, timestamp) * tf / 60000, 3)
+        columns = [timestamp, open_, high, low, close, vol]
+        return [list(row) for row in zip(*[column.tolist() for column in columns])]
+
+    def _trade_ids(self, symbol, since=None, from_id=None, limit=None):
+        info, start, end = self._range(symbol)
+        interval = info["interval"]
+        limit = min(limit or self.trade_limit, self.trade_limit)
+        last = (end - start) // interval
+        if from_id is not None:
+            first = int(from_id)
+        elif since is None:
+            first = last - limit
+        else:
+            # 成交时间在 [start + k*interval, start + (k+1)*interval) 里抖动
+            first = (since - start) // interval
+        ids = np.arange(max(first, 0), max(first, 0) + limit + 1, dtype=np.int64)
+        ids = ids[ids < last]
+        timestamp = start + ids * interval
+        timestamp += (uniform(info["key"] + 3, ids) * interval).astype(np.int64)
+        keep = timestamp < end
+        if since is not None and from_id is None:
+            keep &= timestamp >= since
+        return info, ids[keep][:limit], timestamp[keep][:limit]
+
+    def _trades(self, symbol, since=None, limit=None, params=None):
+        params = params or {}
+        info, ids, timestamp = self._trade_ids(
+            symbol, since, params.get("fromId"), limit
+        )
+        key, scale = info["key"], 10 ** info["decimals"]
+        wave = 0.05 * np.sin(2 * np.pi * timestamp / one_week + key % 7)
+        price = np.round(info["price"] * np.exp(wave) * scale) / scale
+        amount = np.round(10 * uniform(key + 4, ids), 5)
+        side = uniform(key + 5, ids) < 0.5
+        return [
+            {
+                "info": {},
+                "id": str(i),
+                "timestamp": t,
+                "datetime": None,
+                "symbol": symbol,
+                "side": "buy" if s else "sell",
+                "price": p,
+                "amount": a,
+                "cost": p * a,
+            }
+            for i, t, s, p, a in zip(
+                ids.tolist(),
+                timestamp.tolist(),
+                side.tolist(),
+                price.tolist(),
+                amount.tolist(),
+            )
+        ]
+
+    def _tickers(self):
+        now = self.milliseconds()
+        tickers = {}
+        for symbol, info in self.info.items():
+            trading = info["listed_at"] <= now and info["end"] is None
+            volume = float(uniform(info["key"] + 6, [now // one_day])[0]) * 1e6
+            tickers[symbol] = {
+                "symbol": symbol,
+                "quoteVolume": volume if trading else 0,
+            }
+        return tickers
+
+    def fetch_ohlcv(self, symbol, timeframe="1m", since=None, limit=None, params={}):
+        time.sleep(self._delay())
+        self._check("fetch_ohlcv")
+        return self._serve(self._ohlcv(symbol, timeframe, since, limit))
+
+    def fetch_trades(self, symbol, since=None, limit=None, params={}):
+        time.sleep(self._delay())
+        self._check("fetch_trades")
+        return self._serve(self._trades(symbol, since, limit, params))
+
+    def fetch_tickers(self, symbols=None, params={}):
+        time.sleep(self._delay())
+        self._check("fetch_tickers")
+        return self._tickers()
+
+
+class AsyncFakeExchange(FakeExchange):
+    """和 ccxt.async_support 一样的协程接口, 延迟用 asyncio.sleep 模拟"""
+
+    async def sleep(self, milliseconds):
+        await asyncio.sleep(milliseconds / 1000)
+
+    async def close(self):
+        pass
+
+    async def fetch_ohlcv(
+        self, symbol, timeframe="1m", since=None, limit=None, params={}
+    ):
+        await asyncio.sleep(self._delay())
+        self._check("fetch_ohlcv")
+        return self._serve(self._ohlcv(symbol, timeframe, since, limit))
+
+    async def fetch_trades(self, symbol, since=None, limit=None, params={}):
+        await asyncio.sleep(self._delay())
+        self._check("fetch_trades")
+        return self._serve(self._trades(symbol, since, limit, params))
+
+    async def fetch_tickers(self, symbols=None, params={}):
+        await asyncio.sleep(self._delay())
+        self._check("fetch_tickers")
+        return self._tickers()
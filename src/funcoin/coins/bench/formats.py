@@ -0,0 +1,364 @@
+"""日分区存储格式的对比测试, 离线运行.
+
+    python -m funcoin.coins.bench.formats --symbols 200 --trades 1000000
+
+用合成的(或 --kline-csv/--trade-csv 指定的真实)一天数据, 对每种格式统计
+写入耗时, 读取耗时, 文件大小和峰值内存, 输出对比表. 每个格式在单独 fork 的
+子进程里跑, 峰值内存是子进程 ru_maxrss 的增量, 包含 pyarrow/zstd 的堆外内存.
+"""
+
+import argparse
+import json
+import lzma
+import multiprocessing
+import os
+import resource
+import tarfile
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from funcoin.coins.base.batch import (
+    KLINE_COLUMNS,
+    TRADE_COLUMNS,
+    batch_size,
+    concat_batches,
+)
+from funcoin.coins.base.sink import CSVSink, ParquetSink, TimeSeriesSink
+from funcoin.coins.base.tscodec import encode_block, magic, read_blocks, read_tsc
+
+# 子进程 fork 后直接读这里的数据, 不经过 pickle
+_data = {}
+
+
+def kline_day(symbols=200, seed=0):
+    rng = np.random.default_rng(seed)
+    minutes = 1440
+    start = 1704067200000
+    timestamp = np.tile(start + np.arange(minutes, dtype=np.int64) * 60000, symbols)
+    base = np.repeat(10 ** rng.uniform(-3, 4, symbols), minutes)
+    walk = np.cumsum(rng.normal(0, 1e-3, (symbols, minutes)), axis=1).ravel()
+    # 按价格量级保留有效数字, 和交易所返回的 tick 精度接近
+    decimals = np.clip(5 - np.floor(np.log10(base)), 0, 8)
+    scale = 10**decimals
+
+    def price(noise):
+        return np.round(base * np.exp(walk + noise) * scale) / scale
+
+    open_, close = price(0), price(rng.normal(0, 5e-4, symbols * minutes))
+    spread = np.abs(rng.normal(0, 5e-4, symbols * minutes))
+    return {
+        "symbol": np.repeat(
+            np.array([f"S{i:04d}/USDT" for i in range(symbols)], dtype=object),
+            minutes,
+        ),
+        "timestamp": timestamp,
+        "open": open_,
+        "close": close,
+        "low": np.round(np.minimum(open_, close) * (1 - spread) * scale) / scale,
+        "high": np.round(np.maximum(open_, close) * (1 + spread) * scale) / scale,
+        "vol": np.round(rng.lognormal(5, 2, symbols * minutes), 3),
+    }
+
+
+def trade_day(trades=1000000, symbols=50, seed=0):
+    rng = np.random.default_rng(seed)
+    start = 1704067200000
+    sizes = rng.multinomial(trades, rng.dirichlet(np.ones(symbols) * 0.3))
+    batches = []
+    for i, size in enumerate(sizes):
+        if size == 0:
+            continue
+        base = 10 ** rng.uniform(-3, 4)
+        tick = 10 ** (np.floor(np.log10(base)) - 4)
+        price = np.round(base * np.exp(np.cumsum(rng.normal(0, 1e-4, size))) / tick)
+        first_id = int(rng.integers(10**8, 10**9))
+        batches.append(
+            {
+                "symbol": np.full(size, f"S{i:04d}/USDT", dtype=object),
+                "id": np.arange(first_id, first_id + size).astype(str).astype(object),
+                "timestamp": start + np.sort(rng.integers(0, 86400000, size)),
+                "side": np.where(rng.random(size) < 0.5, "b", "s").astype(object),
+                "price": price * tick,
+                "amount": np.round(rng.lognormal(0, 2, size), 5),
+            }
+        )
+    return {
+        name: np.concatenate([batch[name] for batch in batches])
+        for name in batches[0].keys()
+    }
+
+
+def _read_arrow_csv(source):
+    import pyarrow.csv as pcsv
+
+    # 和写入一致: symbol/id/side 按字符串读
+    types = {"symbol": "string", "id": "string", "side": "string"}
+    return pcsv.read_csv(
+        source, convert_options=pcsv.ConvertOptions(column_types=types)
+    )
+
+
+def load_sample(path):
+    """读取一天的 csv(.xz/.gz/.zst 或旧的 .tar) 作为测试数据"""
+    if path.endswith(".tar"):
+        with tarfile.open(path) as tar:
+            table = _read_arrow_csv(tar.extractfile(tar.getmembers()[0]))
+    else:
+        table = _read_csv(path)
+    batch = {}
+    for name in table.column_names:
+        column = table.column(name).to_numpy()
+        batch[name] = column.astype(object) if column.dtype.kind == "O" else column
+    return batch
+
+
+def _write_csv(path, batch, fieldnames, codec=None, level=None):
+    sink = CSVSink(path, fieldnames, codec=codec, level=level)
+    sink.write(batch)
+    sink.close()
+
+
+def _write_csv_tar(path, batch, fieldnames):
+    # 现在 LoadTask 的默认做法: 先写 csv, 再打 tar.xz
+    csv_path = f"{path}.csv"
+    _write_csv(csv_path, batch, fieldnames)
+    with tarfile.open(path, "w|xz") as tar:
+        tar.add(csv_path, arcname=os.path.basename(csv_path))
+    os.remove(csv_path)
+
+
+def _read_csv_tar(path):
+    with tarfile.open(path, "r|xz") as tar:
+        for member in tar:
+            return _read_arrow_csv(tar.extractfile(member))
+
+
+def _open_csv(path):
+    import pyarrow as pa
+
+    # arrow 能识别 .gz/.zst, 但不支持 xz
+    if path.endswith(".xz"):
+        return lzma.open(path, "rb")
+    return pa.input_stream(path, compression="detect")
+
+
+def _read_csv(path):
+    with _open_csv(path) as source:
+        return _read_arrow_csv(source)
+
+
+def _write_parquet(path, batch, fieldnames, compression):
+    sink = ParquetSink(path, fieldnames, compression=compression)
+    sink.write(batch)
+    sink.close()
+
+
+def _write_tsc(path, batch, fieldnames, level=3):
+    sink = TimeSeriesSink(path, fieldnames, level=level)
+    sink.write(batch)
+    sink.close()
+
+
+def _read_parquet(path):
+    import pyarrow.parquet as pq
+
+    return pq.read_table(path)
+
+
+def _write_ipc(path, batch, fieldnames, compression=None):
+    import pyarrow as pa
+
+    arrays = [
+        pa.array(batch[name], pa.string()).dictionary_encode()
+        if name == "symbol"
+        else pa.array(batch[name])
+        for name in fieldnames
+    ]
+    table = pa.Table.from_arrays(arrays, names=fieldnames)
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    with pa.ipc.new_file(path, table.schema, options=options) as writer:
+        writer.write_table(table)
+
+
+def _read_ipc(path):
+    import pyarrow as pa
+
+    with pa.ipc.open_file(path) as reader:
+        return reader.read_all()
+
+
+def _encode_delta(column):
+    """最简单的列编码: 字符串列字典编码, 整数列一阶差分, 作为 tsc 编码的对照"""
+    meta = {}
+    if column.dtype == object:
+        try:
+            column = column.astype(np.int64)
+        except ValueError:
+            values, codes = np.unique(column, return_inverse=True)
+            meta["values"] = values.tolist()
+            column = codes.astype(np.int32)
+    if column.dtype.kind == "i":
+        meta["first"] = int(column[0]) if len(column) else 0
+        column = np.diff(column, prepend=column[:1])
+    meta["dtype"] = column.dtype.str
+    return meta, column.tobytes()
+
+
+def _decode_delta(meta, data, rows):
+    column = np.frombuffer(data, dtype=meta["dtype"])
+    if "first" in meta:
+        # 第一个差分是 0, 累加后加回首值
+        column = np.cumsum(column) + meta["first"]
+    if "values" in meta:
+        column = np.array(meta["values"], dtype=object)[column]
+    return column
+
+
+def _write_delta(path, batch, fieldnames):
+    # 块格式和压缩都用 tscodec 的, 只换列编码
+    columns = {name: batch[name] for name in fieldnames}
+    with open(path, "wb") as fw:
+        fw.write(magic + encode_block(columns, batch_size(batch), encode=_encode_delta))
+
+
+def _read_delta(path):
+    return concat_batches(
+        [block for _, block in read_blocks(path, decode=_decode_delta)]
+    )
+
+
+def _cases():
+    cases = {
+        "csv": (".csv", _write_csv, _read_csv),
+        "csv+tar.xz": (".tar", _write_csv_tar, _read_csv_tar),
+        "csv+xz": (".csv.xz", lambda *a: _write_csv(*a, codec="xz"), _read_csv),
+        "csv+gzip": (".csv.gz", lambda *a: _write_csv(*a, codec="gzip"), _read_csv),
+    }
+    for level in (1, 3, 10, 19):
+        cases[f"csv+zstd-{level}"] = (
+            ".csv.zst",
+            lambda *a, level=level: _write_csv(*a, codec="zstd", level=level),
+            _read_csv,
+        )
+    for compression in ("snappy", "zstd"):
+        cases[f"parquet-{compression}"] = (
+            ".parquet",
+            lambda *a, c=compression: _write_parquet(*a, compression=c),
+            _read_parquet,
+        )
+    cases["arrow-ipc"] = (".arrow", _write_ipc, _read_ipc)
+    cases["arrow-ipc-zstd"] = (
+        ".arrow",
+        lambda *a: _write_ipc(*a, compression="zstd"),
+        _read_ipc,
+    )
+    cases["delta-binary"] = (".bin", _write_delta, _read_delta)
+    for level in (3, 19):
+        cases[f"tsc-{level}"] = (
+            ".tsc",
+            lambda *a, level=level: _write_tsc(*a, level=level),
+            # 和 parquet 一样读出 int64 的 id 和 bool 的 side
+            lambda path: read_tsc(path, decode=False),
+        )
+    return cases
+
+
+def _rows(result):
+    return result.num_rows if hasattr(result, "num_rows") else batch_size(result)
+
+
+def _run_case(kind, case, workdir):
+    suffix, write, read = _cases()[case]
+    batch = _data[kind]
+    fieldnames = ["symbol"] + (KLINE_COLUMNS if kind == "kline" else TRADE_COLUMNS)
+    path = os.path.join(workdir, f"{kind}-{case}{suffix}")
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    write(path, batch, fieldnames)
+    write_cost = time.perf_counter() - start
+    start = time.perf_counter()
+    rows = _rows(read(path))
+    read_cost = time.perf_counter() - start
+    size = os.path.getsize(path)
+    os.remove(path)
+    if rows != batch_size(batch):
+        raise ValueError(f"{case} read {rows} rows, wrote {batch_size(batch)}")
+    return {
+        "data": kind,
+        "format": case,
+        "rows": rows,
+        "bytes": size,
+        "write_s": write_cost,
+        "read_s": read_cost,
+        "peak_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss)
+        / 1024,
+    }
+
+
+def run(kinds=("kline", "trade"), cases=None, workdir=None):
+    cases = cases or list(_cases())
+    context = multiprocessing.get_context("fork")
+    results = []
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for kind in kinds:
+            for case in cases:
+                # 每个格式一个新的子进程, 互不影响峰值内存
+                with ProcessPoolExecutor(1, mp_context=context) as pool:
+                    try:
+                        results.append(pool.submit(_run_case, kind, case, tmp).result())
+                    except ImportError as e:
+                        print(f"skip {kind} {case}: {e}")
+    return results
+
+
+def format_table(results):
+    lines = [
+        f"{'data':<6} {'format':<16} {'MB':>9} {'ratio':>7} "
+        f"{'write s':>8} {'read s':>8} {'peak MB':>8}"
+    ]
+    plain = {r["data"]: r["bytes"] for r in results if r["format"] == "csv"}
+    for r in results:
+        ratio = plain.get(r["data"], r["bytes"]) / r["bytes"]
+        lines.append(
+            f"{r['data']:<6} {r['format']:<16} {r['bytes'] / 2**20:>9.2f} "
+            f"{ratio:>7.2f} {r['write_s']:>8.3f} {r['read_s']:>8.3f} "
+            f"{r['peak_mb']:>8.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="daily partition format benchmark")
+    parser.add_argument("--symbols", type=int, default=200, help="kline symbols")
+    parser.add_argument("--trades", type=int, default=1000000, help="trade rows")
+    parser.add_argument("--kline-csv", default=None, help="sample kline day")
+    parser.add_argument("--trade-csv", default=None, help="sample trade day")
+    parser.add_argument("--data", default="kline,trade", help="kline,trade")
+    parser.add_argument("--formats", default=None, help="comma separated formats")
+    parser.add_argument("--workdir", default=None, help="where to write files")
+    parser.add_argument("--json", default=None, help="also write results here")
+    args = parser.parse_args(args)
+
+    kinds = args.data.split(",")
+    if "kline" in kinds:
+        _data["kline"] = (
+            load_sample(args.kline_csv) if args.kline_csv else kline_day(args.symbols)
+        )
+    if "trade" in kinds:
+        _data["trade"] = (
+            load_sample(args.trade_csv) if args.trade_csv else trade_day(args.trades)
+        )
+    cases = args.formats.split(",") if args.formats else None
+    results = run(kinds, cases, args.workdir)
+    print(format_table(results))
+    if args.json is not None:
+        with open(args.json, "w") as fw:
+            json.dump(results, fw, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
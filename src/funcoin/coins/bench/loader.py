@@ -0,0 +1,200 @@
+"""用假交易所离线压测 KlineLoder, TradeLoader 和 LoadTask.
+
+    python -m funcoin.coins.bench.loader --symbols 200 --latency 0.02 --use-async
+
+每个场景在单独 fork 的子进程里跑, 统计行数/秒, 请求数/秒, CPU 时间和峰值内存.
+数据由 FakeExchange 确定性生成, 同样的参数每次跑的请求和数据都一样.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+from funcoin.coins.base.loader import KlineLoder, TradeLoader
+from funcoin.coins.base.profile import profiler
+from funcoin.coins.base.ratelimit import get_rate_limiter
+from funcoin.coins.bench.exchange import AsyncFakeExchange, FakeExchange, one_day
+
+
+class LocalTable:
+    """DriveTable 的本地替身, 上传就是复制到目录里"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def update_partition_dict(self):
+        pass
+
+    def update_partition_meta(self, refresh=False):
+        pass
+
+    def partition_meta(self):
+        return [{"name": name} for _, _, files in os.walk(self.path) for name in files]
+
+    def upload(self, file, partition, overwrite=True):
+        os.makedirs(os.path.join(self.path, partition), exist_ok=True)
+        shutil.copy(file, os.path.join(self.path, partition, os.path.basename(file)))
+
+
+def _exchanges(args, symbols):
+    kwargs = dict(
+        symbols=symbols,
+        seed=args.seed,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        weight_limit=args.weight_limit,
+        ohlcv_limit=args.ohlcv_limit,
+    )
+    return FakeExchange(**kwargs), AsyncFakeExchange(**kwargs)
+
+
+def _loader_kwargs(args, workdir, exchange, async_exchange):
+    unix_start = int(
+        datetime.strptime(args.day, "%Y%m%d").replace(tzinfo=timezone.utc).timestamp()
+        * 1000
+    )
+    return {
+        "unix_start": unix_start,
+        "unix_end": unix_start + one_day,
+        "csv_path": os.path.join(workdir, "data.csv"),
+        "use_async": args.use_async,
+        "max_concurrency": args.max_concurrency,
+        "async_exchange": async_exchange,
+        "rate_limiter": get_rate_limiter(exchange.id, backend="local"),
+    }
+
+
+def run_kline(args, workdir, exchange, async_exchange):
+    kwargs = _loader_kwargs(args, workdir, exchange, async_exchange)
+    KlineLoder(
+        exchange, page_concurrency=args.page_concurrency, **kwargs
+    ).load_symbols()
+
+
+def run_trade(args, workdir, exchange, async_exchange):
+    kwargs = _loader_kwargs(args, workdir, exchange, async_exchange)
+    # TradeLoader 只有同步模式
+    kwargs["use_async"] = False
+    TradeLoader(exchange, shards=args.shards, **kwargs).load_symbols()
+
+
+def run_task(args, workdir, exchange, async_exchange):
+    # 函数内导入, 只有这个场景需要 funtable
+    from funcoin.coins.table.load import LoadTask
+
+    os.chdir(workdir)
+    # 不用 checkpoint 和 MarketIndex, 避免往本机的 ~/.cache/funcoin 里写假数据
+    task = LoadTask(
+        LocalTable(os.path.join(workdir, "table")),
+        exchange,
+        use_async=args.use_async,
+        max_concurrency=args.max_concurrency,
+        codec=args.codec,
+        resume=False,
+        active_only=False,
+        rate_limit_backend="local",
+        download_workers=args.download_workers,
+        async_exchange=async_exchange,
+    )
+    task.run(days=args.days)
+
+
+scenarios = {"kline": run_kline, "trade": run_trade, "task": run_task}
+
+
+def _run_scenario(name, args):
+    symbols = args.trade_symbols if name == "trade" else args.symbols
+    exchange, async_exchange = _exchanges(args, symbols)
+    # 限流器按交易所缓存在进程内, 先用压测的额度创建, loader 和 LoadTask 拿到的都是它
+    get_rate_limiter(exchange.id, backend="local", limit=args.rate_limit, period=60)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        start, cpu = time.perf_counter(), time.process_time()
+        try:
+            scenarios[name](args, workdir, exchange, async_exchange)
+        finally:
+            os.chdir(cwd)
+        wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+    rows = exchange.rows + async_exchange.rows
+    requests = sum(exchange.requests.values()) + sum(async_exchange.requests.values())
+    return {
+        "scenario": name,
+        "mode": "async" if args.use_async and name != "trade" else "sync",
+        "symbols": symbols,
+        "rows": rows,
+        "requests": requests,
+        "wall_s": wall,
+        "rows_per_s": rows / wall,
+        "requests_per_s": requests / wall,
+        "cpu_s": cpu,
+        "peak_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss)
+        / 1024,
+        "stages": profiler.to_dict(symbols=False)["stages"],
+    }
+
+
+def run(args):
+    context = multiprocessing.get_context("fork")
+    results = []
+    for name in args.scenarios.split(","):
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            results.append(pool.submit(_run_scenario, name, args).result())
+    return results
+
+
+def format_table(results):
+    lines = [
+        f"{'scenario':<8} {'mode':<5} {'rows':>10} {'requests':>8} {'wall s':>8} "
+        f"{'rows/s':>10} {'req/s':>8} {'cpu s':>7} {'peak MB':>8}"
+    ]
+    for r in results:
+        lines.append(
+            f"{r['scenario']:<8} {r['mode']:<5} {r['rows']:>10} {r['requests']:>8} "
+            f"{r['wall_s']:>8.2f} {r['rows_per_s']:>10.0f} "
+            f"{r['requests_per_s']:>8.1f} {r['cpu_s']:>7.2f} {r['peak_mb']:>8.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="offline loader benchmark")
+    parser.add_argument("--scenarios", default="kline,trade,task")
+    parser.add_argument("--symbols", type=int, default=200)
+    parser.add_argument("--trade-symbols", type=int, default=10)
+    parser.add_argument("--day", default="20240101", help="kline/trade day, UTC")
+    parser.add_argument("--days", type=int, default=2, help="LoadTask days")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--weight-limit", type=int, default=None, help="per minute")
+    parser.add_argument("--rate-limit", type=int, default=10**9, help="client side")
+    parser.add_argument("--ohlcv-limit", type=int, default=1000)
+    parser.add_argument("--use-async", action="store_true")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--page-concurrency", type=int, default=4)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--download-workers", type=int, default=1)
+    parser.add_argument("--codec", default=None)
+    parser.add_argument("--json", default=None, help="also write results here")
+    args = parser.parse_args(args)
+
+    results = run(args)
+    print(format_table(results))
+    if args.json is not None:
+        with open(args.json, "w") as fw:
+            json.dump(results, fw, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
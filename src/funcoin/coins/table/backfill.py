@@ -0,0 +1,91 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import funutil
+
+from funcoin.coins.table.load import LoadTask
+
+logger = funutil.getLogger("funcoin")
+
+# 每个工作进程自己的 LoadTask, 由 _init_worker 创建
+_task = None
+
+
+def _init_worker(exchange_factory, table_factory, task_kwargs):
+    global _task
+    # 交易所和 table 的客户端不能跨进程传递, 在子进程里各自创建
+    _task = LoadTask(table_factory(), exchange_factory(), **task_kwargs)
+
+
+def _run_day(ds):
+    start = time.time()
+    try:
+        _task.download_kline(_task.file_property(ds))
+        return ds, time.time() - start, None
+    except Exception as e:
+        return ds, time.time() - start, repr(e)
+
+
+class BackfillScheduler:
+    """把缺失的天分发给多个进程并行回补, 最近的天优先.
+
+    exchange_factory/table_factory 必须是模块级函数, 每个子进程调用一次;
+    所有子进程通过文件令牌桶共享同一份交易所请求额度.
+    """
+
+    def __init__(
+        self,
+        exchange_factory,
+        table_factory,
+        processes=4,
+        max_pending=None,
+        **task_kwargs,
+    ):
+        self.exchange_factory = exchange_factory
+        self.table_factory = table_factory
+        self.processes = processes
+        # 在途的天数有上限, 保证按最近优先的顺序依次派发
+        self.max_pending = max_pending or processes * 2
+        # 本地令牌桶只在单进程内有效, 多进程必须用文件后端
+        task_kwargs["rate_limit_backend"] = "file"
+        self.task_kwargs = task_kwargs
+
+    def missing_days(self, days=365, discover_listing=None):
+        task = LoadTask(
+            self.table_factory(), self.exchange_factory(), **self.task_kwargs
+        )
+        return [
+            file_pro.start_date.strftime("%Y%m%d")
+            for file_pro in task.missing_days(days, discover_listing)
+        ]
+
+    def run(self, days=365, discover_listing=None):
+        # 上市时间和活跃交易对在主进程里刷新一次, 子进程直接读同一个 sqlite
+        todo = self.missing_days(days, discover_listing)
+        total = len(todo)
+        logger.info(f"backfill {total} days with {self.processes} processes")
+        failed = []
+        done = 0
+        start = time.time()
+        with ProcessPoolExecutor(
+            max_workers=self.processes,
+            initializer=_init_worker,
+            initargs=(self.exchange_factory, self.table_factory, self.task_kwargs),
+        ) as pool:
+            pending = set()
+            while todo or pending:
+                while todo and len(pending) < self.max_pending:
+                    pending.add(pool.submit(_run_day, todo.pop(0)))
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    ds, cost, error = future.result()
+                    done += 1
+                    if error is not None:
+                        failed.append(ds)
+                        logger.error(f"backfill {ds} failed: {error}")
+                    speed = done / (time.time() - start)
+                    logger.info(
+                        f"backfill {ds} in {cost:.1f}s, {done}/{total}, "
+                        f"{speed * 3600:.1f} days/h, eta {(total - done) / speed:.0f}s"
+                    )
+        return failed
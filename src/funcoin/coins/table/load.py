@@ -1,5 +1,7 @@
 import logging
 import os
+import queue
+import threading
 from datetime import datetime, timedelta
 
 import ccxt
@@ -7,14 +9,31 @@ import funutil
 from funfile.compress import tarfile
 from funtable import DriveTable
 
+from funcoin.coins.base.concurrency import AdaptiveConcurrency
 from funcoin.coins.base.loader import BaseLoader, KlineLoder, TradeLoader
+from funcoin.coins.base.market import MarketIndex
+from funcoin.coins.base.metrics import registry
+from funcoin.coins.base.profile import SamplingProfiler, profiler
+from funcoin.coins.base.ratelimit import get_rate_limiter
+from funcoin.coins.base.sink import codec_suffix
+from funcoin.coins.base.store import CheckpointStore
 
 logger = funutil.getLogger("funcoin")
 
 
 class FileProperty:
-    def __init__(self, exchange_name, data_type="kline", timeframe="1m"):
+    def __init__(
+        self,
+        exchange_name,
+        data_type="kline",
+        timeframe="1m",
+        data_format="csv",
+        codec=None,
+    ):
         self.data_type = data_type
+        self.data_format = data_format
+        # csv 边写边压缩的格式, None 时沿用下载完再打 tar.xz 的老流程
+        self.codec = codec
         self.timeframe = timeframe
         self.exchange_name = exchange_name
 
@@ -42,74 +61,317 @@ class FileProperty:
 
     @property
     def file_path_csv(self):
+        if self.codec is not None:
+            return f"{self.filename_prefix}.csv.{codec_suffix[self.codec]}"
         return f"{self.filename_prefix}.csv"
 
     @property
     def file_path_tar(self):
         return f"{self.filename_prefix}.tar"
 
+    @property
+    def file_path_parquet(self):
+        return f"{self.filename_prefix}.parquet"
+
+    @property
+    def file_path_tsc(self):
+        return f"{self.filename_prefix}.tsc"
+
+    @property
+    def file_path_data(self):
+        if self.data_format == "parquet":
+            return self.file_path_parquet
+        if self.data_format == "tsc":
+            return self.file_path_tsc
+        return self.file_path_csv
+
+    @property
+    def file_path_data_temp(self):
+        # 下载中的文件, 完整写完后才 rename 成正式文件名, 并发的多天互不干扰
+        return f"{self.file_path_data}.part"
+
+    @property
+    def file_path_upload(self):
+        if self.data_format in ("parquet", "tsc"):
+            return self.file_path_data
+        if self.codec is not None:
+            return self.file_path_csv
+        return self.file_path_tar
+
 
 class LoadTask:
     def __init__(
         self,
         table: DriveTable,
         exchange: ccxt.Exchange,
+        use_async=False,
+        max_concurrency=8,
+        data_format="csv",
+        codec=None,
+        resume=True,
+        active_only=False,
+        discover_listing=False,
+        trade_shards=1,
+        rate_limit_backend="file",
+        adaptive=True,
+        metrics_path=None,
+        response_cache=None,
+        download_workers=1,
+        compress_workers=1,
+        upload_workers=1,
+        queue_size=2,
+        async_exchange=None,
+        profile_path=None,
+        sample_path=None,
+        sample_interval=0.005,
     ):
         self.table = table
         self.exchange = exchange
+        self.data_format = data_format
+        self.codec = codec
+        self.checkpoint = CheckpointStore() if resume else None
+        # 同一台机器上所有 LoadTask/loader 共用一个按交易所划分的令牌桶
+        self.rate_limiter = get_rate_limiter(exchange.id, backend=rate_limit_backend)
+        # 按交易所的响应自动调整在途请求数, 所有 loader 共用
+        self.controller = AdaptiveConcurrency() if adaptive else None
+        # 开启后每次 missing_days 都会 refresh 市场索引(fetch_tickers 加新交易对的探测),
+        # 下载时跳过已下架和长期无成交的交易对
+        self.market_index = None
+        if active_only:
+            self.market_index = MarketIndex(exchange, rate_limiter=self.rate_limiter)
+        # 对没见过的交易对二分查找上线时间, 冷启动时每个交易对要多请求十几次;
+        # 关闭时只用索引里已经缓存的上线时间
+        self.discover_listing = discover_listing
+        self.use_async = use_async
+        self.max_concurrency = max_concurrency
+        self.trade_shards = trade_shards
+        self.metrics_path = metrics_path
+        # 可选的本地响应缓存, 重跑同一天时已收盘的数据不再请求交易所
+        self.response_cache = response_cache
+        self.async_exchange = async_exchange
+        # 分阶段的耗时汇总, 以及可选的采样 profiler(collapsed stack, 可直接画火焰图)
+        self.profile_path = profile_path
+        self.sample_path = sample_path
+        self.sample_interval = sample_interval
+        # run 时 下载 -> 压缩 -> 上传 三段流水线, 每段的线程数和段间队列长度
+        self.download_workers = download_workers
+        self.compress_workers = compress_workers
+        self.upload_workers = upload_workers
+        self.queue_size = queue_size
 
     def download(self, loader: BaseLoader, file_pro: FileProperty) -> bool:
-        logger.info(f"download for {file_pro.file_path_tar}")
-        # 下载
-        loader.load_symbols()
-        # 压缩
-        with tarfile.open(file_pro.file_path_tar, "w|xz") as tar:
-            tar.add(file_pro.file_path_csv)
-        self.table.upload(
-            file=file_pro.file_path_tar, partition=file_pro.partition, overwrite=True
-        )
+        self.fetch(loader, file_pro)
+        self.compress(file_pro)
+        return self.upload(file_pro)
+
+    def fetch(self, loader: BaseLoader, file_pro: FileProperty):
+        logger.info(f"download for {file_pro.file_path_upload}")
+        with profiler.stage("download") as span:
+            loader.load_symbols()
+            span["bytes"] = os.path.getsize(file_pro.file_path_data_temp)
+        incomplete = getattr(loader, "incomplete", None)
+        if incomplete:
+            # 不完整的一天不能上传, 保留 .part 和 checkpoint, 下次从断点继续
+            raise RuntimeError(
+                f"{file_pro.file_path_data} incomplete, retry later: "
+                f"{sorted(incomplete)}"
+            )
+        os.replace(file_pro.file_path_data_temp, file_pro.file_path_data)
+        if self.checkpoint is not None:
+            self.checkpoint.clear(os.path.abspath(file_pro.file_path_data_temp))
+
+    def compress(self, file_pro: FileProperty):
+        # parquet 和 tsc 自带列压缩, 带 codec 的 csv 写入时已压缩, 直接上传
+        if file_pro.data_format == "csv" and file_pro.codec is None:
+            temp_path = f"{file_pro.file_path_tar}.part"
+            with profiler.stage("compress") as span:
+                with tarfile.open(temp_path, "w|xz") as tar:
+                    tar.add(file_pro.file_path_csv)
+                span["bytes"] = os.path.getsize(temp_path)
+            os.replace(temp_path, file_pro.file_path_tar)
 
+    def upload(self, file_pro: FileProperty) -> bool:
+        nbytes = os.path.getsize(file_pro.file_path_upload)
+        with profiler.stage("upload", nbytes=nbytes):
+            self.table.upload(
+                file=file_pro.file_path_upload,
+                partition=file_pro.partition,
+                overwrite=True,
+            )
         # 删除
-        if os.path.exists(file_pro.file_path_csv):
-            os.remove(file_pro.file_path_csv)
-        if os.path.exists(file_pro.file_path_tar):
-            os.remove(file_pro.file_path_tar)
+        for path in {file_pro.file_path_data, file_pro.file_path_upload}:
+            if os.path.exists(path):
+                os.remove(path)
+        self.report_metrics()
         return True
 
-    def download_kline(self, file_pro: FileProperty) -> bool:
-        loader = KlineLoder(
+    def report_metrics(self):
+        logger.info(f"request budget: {registry.budget_report()}")
+        if self.metrics_path is not None:
+            registry.write(self.metrics_path)
+        logger.info(f"stages: {profiler.summary()}")
+        if self.profile_path is not None:
+            profiler.write(self.profile_path)
+
+    def _loader_kwargs(self, file_pro: FileProperty):
+        kwargs = {
+            "unix_start": int(file_pro.start_date.timestamp() * 1000),
+            "unix_end": int(file_pro.end_date.timestamp() * 1000),
+            "timeframe": file_pro.timeframe,
+            "checkpoint": self.checkpoint,
+            "market_index": self.market_index,
+            "rate_limiter": self.rate_limiter,
+            "controller": self.controller,
+            "response_cache": self.response_cache,
+            "async_exchange": self.async_exchange,
+        }
+        if file_pro.data_format == "parquet":
+            kwargs["parquet_path"] = file_pro.file_path_data_temp
+        elif file_pro.data_format == "tsc":
+            kwargs["tsc_path"] = file_pro.file_path_data_temp
+        else:
+            kwargs["csv_path"] = file_pro.file_path_data_temp
+            kwargs["codec"] = file_pro.codec
+        return kwargs
+
+    def kline_loader(self, file_pro: FileProperty, use_async=None) -> KlineLoder:
+        return KlineLoder(
             self.exchange,
-            unix_start=int(file_pro.start_date.timestamp() * 1000),
-            unix_end=int(file_pro.end_date.timestamp() * 1000),
-            csv_path=file_pro.file_path_csv,
-            timeframe=file_pro.timeframe,
+            use_async=self.use_async if use_async is None else use_async,
+            max_concurrency=self.max_concurrency,
+            **self._loader_kwargs(file_pro),
         )
-        return self.download(loader, file_pro)
+
+    def download_kline(self, file_pro: FileProperty, use_async=None) -> bool:
+        return self.download(self.kline_loader(file_pro, use_async), file_pro)
 
     def download_trade(self, file_pro: FileProperty) -> bool:
         loader = TradeLoader(
-            self.exchange,
-            unix_start=int(file_pro.start_date.timestamp() * 1000),
-            unix_end=int(file_pro.end_date.timestamp() * 1000),
-            csv_path=file_pro.file_path_csv,
-            timeframe=file_pro.timeframe,
+            self.exchange, shards=self.trade_shards, **self._loader_kwargs(file_pro)
         )
         return self.download(loader, file_pro)
 
-    def run(self, days=365):
+    def missing_days(self, days=365, discover_listing=None):
+        """从昨天往前 days 天里还没有上传的分区, 最近的排在前面"""
+        if discover_listing is None:
+            discover_listing = self.discover_listing
         self.table.update_partition_dict()
         self.table.update_partition_meta(refresh=True)
+        earliest = None
+        if self.market_index is not None:
+            self.market_index.refresh()
+            if discover_listing:
+                self.market_index.discover_listings()
+            earliest = self.market_index.earliest_listing()
 
         start_day = datetime.now() - timedelta(days=1)
-        file_pro = FileProperty(self.exchange.name.lower()).daily(
-            start_day.strftime("%Y%m%d")
-        )
         exists_data = dict([file["name"], file] for file in self.table.partition_meta())
 
+        file_pros = []
         for i in range(days):
             start_day += timedelta(days=-1)
-            file_pro.daily(start_day.strftime("%Y%m%d"))
-            if file_pro.file_path_tar in exists_data.keys():
-                logger.info(f"{file_pro.file_path_tar} exists, skip.")
+            # 流水线里多天同时在跑, 每天一个独立的 FileProperty
+            file_pro = self.file_property(start_day.strftime("%Y%m%d"))
+            if (
+                earliest is not None
+                and file_pro.end_date.timestamp() * 1000 <= earliest
+            ):
+                logger.info(f"no symbol listed before {file_pro.end_date}, stop.")
+                break
+            if file_pro.file_path_upload in exists_data.keys():
+                logger.info(f"{file_pro.file_path_upload} exists, skip.")
+                continue
+            file_pros.append(file_pro)
+        return file_pros
+
+    def file_property(self, ds, data_type="kline") -> FileProperty:
+        return FileProperty(
+            self.exchange.name.lower(),
+            data_type=data_type,
+            data_format=self.data_format,
+            codec=self.codec,
+        ).daily(ds)
+
+    def publish_jobs(self, queue, days=365, discover_listing=None):
+        """把缺失的天发布到 WorkQueue, 由各节点的 run_jobs 领取"""
+        jobs = [
+            {
+                "exchange": self.exchange.id,
+                "data_type": file_pro.data_type,
+                "day": file_pro.start_date.strftime("%Y%m%d"),
+            }
+            for file_pro in self.missing_days(days, discover_listing)
+        ]
+        added = queue.publish(jobs)
+        logger.info(f"published {added} new of {len(jobs)} jobs: {queue.stats()}")
+        return added
+
+    def run_job(self, job):
+        if job["exchange"] != self.exchange.id:
+            raise ValueError(f"job for {job['exchange']} on {self.exchange.id}")
+        file_pro = self.file_property(job["day"], job["data_type"])
+        if job["data_type"] == "trade":
+            return self.download_trade(file_pro)
+        return self.download_kline(file_pro)
+
+    def run_jobs(self, queue, worker=None, stop_when_empty=True):
+        registry.reset()
+        profiler.reset()
+        return queue.work(self.run_job, worker=worker, stop_when_empty=stop_when_empty)
+
+    def run(self, days=365, discover_listing=None):
+        registry.reset()
+        profiler.reset()
+        if self.sample_path is None:
+            self.run_pipeline(self.missing_days(days, discover_listing))
+            return
+        with SamplingProfiler(self.sample_interval) as sampler:
+            self.run_pipeline(self.missing_days(days, discover_listing))
+        sampler.write(self.sample_path)
+        logger.info(f"hot spots: {sampler.top(10)}")
+
+    def run_pipeline(self, file_pros):
+        """第 N 天上传时第 N+1 天在压缩, 第 N+2 天在下载, 段间用有界队列做背压"""
+        stages = [
+            (lambda fp: self.fetch(self.kline_loader(fp), fp), self.download_workers),
+            (self.compress, self.compress_workers),
+            (self.upload, self.upload_workers),
+        ]
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in stages] + [None]
+        threads = []
+        for (func, workers), inbox, outbox in zip(stages, queues, queues[1:]):
+            threads.append(
+                [
+                    threading.Thread(
+                        target=self._stage_worker, args=(func, inbox, outbox)
+                    )
+                    for _ in range(workers)
+                ]
+            )
+        for workers in threads:
+            for thread in workers:
+                thread.start()
+
+        for file_pro in file_pros:
+            queues[0].put(file_pro)
+        # 上一段全部结束后再给下一段发结束标记
+        for workers, inbox in zip(threads, queues):
+            for _ in workers:
+                inbox.put(None)
+            for thread in workers:
+                thread.join()
+
+    @staticmethod
+    def _stage_worker(func, inbox, outbox):
+        while True:
+            file_pro = inbox.get()
+            if file_pro is None:
+                break
+            try:
+                func(file_pro)
+            except Exception as e:
+                # 某一天失败不影响其它天, 这一天留给下次 run 重新下载
+                logger.error(f"{file_pro.file_path_upload} failed: {e}")
                 continue
-            self.download_kline(file_pro)
+            if outbox is not None:
+                outbox.put(file_pro)
@@ -3,18 +3,21 @@ from fundrive import OSSDrive
 from funsecret import read_secret
 from funtable import DriveTable
 
+from funcoin.coins.base.workqueue import WorkQueue
+from funcoin.coins.table.backfill import BackfillScheduler
 from funcoin.coins.table.load import LoadTask
 
 
-def download_daily(days=800, *arge, **kwargs):
-    days = int(days)
-    exchange = ccxt.binance(  # noqa: F821
+def binance_exchange():
+    return ccxt.binance(  # noqa: F821
         {
             "apiKey": read_secret("coin", "binance", "api_key"),
             "secret": read_secret("coin", "binance", "secret_key"),
         }
     )
 
+
+def binance_kline_table():
     drive = OSSDrive()
 
     drive.login(
@@ -26,8 +29,53 @@ def download_daily(days=800, *arge, **kwargs):
 
     table = DriveTable(table_fid="funcoin/binance_kline_daily_1m/", drive=drive)
     table.update_partition_meta()
-    task = LoadTask(table=table, exchange=exchange)
-    task.run(days=days)
+    return table
+
+
+def download_daily(
+    days=800,
+    use_async=False,
+    data_format="csv",
+    codec=None,
+    processes=1,
+    queue=None,
+    worker=False,
+    discover_listing=False,
+    *arge,
+    **kwargs,
+):
+    days = int(days)
+    processes = int(processes)
+    if queue is None and processes > 1:
+        scheduler = BackfillScheduler(
+            binance_exchange,
+            binance_kline_table,
+            processes=processes,
+            use_async=use_async,
+            data_format=data_format,
+            codec=codec,
+            active_only=True,
+            discover_listing=discover_listing,
+        )
+        scheduler.run(days=days)
+        return
+
+    task = LoadTask(
+        table=binance_kline_table(),
+        exchange=binance_exchange(),
+        use_async=use_async,
+        data_format=data_format,
+        codec=codec,
+        active_only=True,
+        discover_listing=discover_listing,
+    )
+    if queue is None:
+        task.run(days=days)
+    elif worker:
+        # 多个节点各自跑 worker, 每个节点按自己的 ip 限速, 总吞吐随节点数增加
+        task.run_jobs(WorkQueue(queue), stop_when_empty=False)
+    else:
+        task.publish_jobs(WorkQueue(queue), days=days)
 
 
 # download_daily(days=3)
@@ -20,6 +20,30 @@ def funcoin():
 
     build_parser1 = subparsers.add_parser("download", help="download daily")
     build_parser1.add_argument("--days", default=365, help="days")
+    build_parser1.add_argument(
+        "--use-async", dest="use_async", action="store_true", help="async loader"
+    )
+    build_parser1.add_argument(
+        "--data-format", dest="data_format", default="csv", help="csv, parquet or tsc"
+    )
+    build_parser1.add_argument(
+        "--codec", dest="codec", default=None, help="csv codec: xz, gzip or zstd"
+    )
+    build_parser1.add_argument(
+        "--processes", default=1, help="backfill days in parallel processes"
+    )
+    build_parser1.add_argument(
+        "--queue", default=None, help="work queue: sqlite:///path or redis://host"
+    )
+    build_parser1.add_argument(
+        "--worker", action="store_true", help="pull days from --queue"
+    )
+    build_parser1.add_argument(
+        "--discover-listing",
+        dest="discover_listing",
+        action="store_true",
+        help="probe listing time of new symbols, costs extra requests per symbol",
+    )
     build_parser1.set_defaults(func=download_daily)
 
     args = parser.parse_args()
@@ -29,6 +29,7 @@ class RestApiSyncClient(object):
             secret_key: The private key applied from Huobi.
             url: The URL name like "https://api.huobi.pro".
             performance_test: for performance test
+            controller: AdaptiveConcurrency to adapt concurrency to 429/5xx and latency
             init_log: to init logger
         """
         self.__api_key = api_key
@@ -36,6 +37,7 @@ class RestApiSyncClient(object):
         self.__server_url = url or get_default_server_url(None)
         self.__init_log = kwargs.get("init_log", None)
         self.__performance_test = kwargs.get("performance_test", None)
+        self.__controller = kwargs.get("controller", None)
         if self.__init_log and self.__init_log:
             logger.addHandler(logging.StreamHandler())
 
@@ -78,7 +80,7 @@ class RestApiSyncClient(object):
     def request_process_product(self, method, url, params):
         request = self.create_request(method, url, params)
         if request:
-            return call_sync(request)
+            return call_sync(request, controller=self.__controller)
 
         return None
 
@@ -120,7 +122,7 @@ class RestApiSyncClient(object):
     def request_process_post_batch_product(self, method, url, params):
         request = self.create_request_post_batch(method, url, params)
         if request:
-            return call_sync(request)
+            return call_sync(request, controller=self.__controller)
 
         return None
 
@@ -8,6 +8,7 @@ import urllib.parse
 import requests
 import websocket
 from apscheduler.schedulers.blocking import BlockingScheduler
+from funcoin.coins.base.metrics import track_request
 from funcoin.huobi.constant import *
 from funcoin.huobi.constant import ApiVersion
 from funcoin.huobi.utils import *
@@ -91,19 +92,33 @@ def check_responses(dict_data):
         )
 
 
-def call_sync(request, is_checked=False):
+def send_request(request, controller=None):
+    def send():
+        if request.method == "GET":
+            return session.get(request.host + request.url, headers=request.header)
+        return session.post(
+            request.host + request.url,
+            data=json.dumps(request.post_body),
+            headers=request.header,
+        )
+
+    with track_request(
+        "huobi", f"{request.method} {request.url.split('?')[0]}", controller=controller
+    ) as span:
+        response = send()
+        span["status"], span["headers"] = response.status_code, response.headers
+        return response
+
+
+def call_sync(request, is_checked=False, controller=None):
     if request.method == "GET":
-        response = session.get(request.host + request.url, headers=request.header)
+        response = send_request(request, controller)
         if is_checked is True:
             return response.text
         return Response(response=response.text)
 
     elif request.method == "POST":
-        response = session.post(
-            request.host + request.url,
-            data=json.dumps(request.post_body),
-            headers=request.header,
-        )
+        response = send_request(request, controller)
         return Response(response=response.text)
 
 
@@ -3,6 +3,7 @@ import logging
 from typing import Dict, Optional
 
 import requests
+from funcoin.coins.base.metrics import track_request
 from funcoin.okex.common import exceptions
 from funcoin.okex import utils
 from funcoin.okex.types import Response
@@ -26,6 +27,7 @@ class BaseClient(object):
         api_url=None,
         flag="1",
         proxy=None,
+        controller=None,
     ):
         self.API_KEY = api_key
         self.API_SECRET_KEY = api_secret_key
@@ -36,6 +38,16 @@ class BaseClient(object):
         self.test = test
         self.api_url = api_url or API_URL
         self.proxy = proxy
+        self.controller = controller
+
+    def _send(self, method, url, body, header):
+        if method == GET:
+            return requests.get(url, headers=header, proxies=self.proxy)
+        elif method == POST:
+            return requests.post(url, data=body, headers=header, proxies=self.proxy)
+        elif method == DELETE:
+            return requests.delete(url, headers=header, proxies=self.proxy)
+        return None
 
     def _request(self, method, uri, params, cursor=False):
         if method == GET:
@@ -72,24 +84,11 @@ class BaseClient(object):
         logging.debug("body: " + body)
 
         # send request
-        response = None
-        if method == GET:
-            if self.proxy is None:
-                response = requests.get(url, headers=header)
-            else:
-                response = requests.get(url, headers=header, proxies=self.proxy)
-        elif method == POST:
-            if self.proxy is None:
-                response = requests.post(url, data=body, headers=header)
-            else:
-                response = requests.post(
-                    url, data=body, headers=header, proxies=self.proxy
-                )
-        elif method == DELETE:
-            if self.proxy is None:
-                response = requests.delete(url, headers=header)
-            else:
-                response = requests.delete(url, headers=header, proxies=self.proxy)
+        with track_request(
+            "okx", f"{method} {uri.split('?')[0]}", controller=self.controller
+        ) as span:
+            response = self._send(method, url, body, header)
+            span["status"], span["headers"] = response.status_code, response.headers
 
         # exception handle
         if not str(response.status_code).startswith("2"):